@@ -1,205 +1,1181 @@
 import os
 import re
+import json
+import time
+import math
+import atexit
+import hmac
+import hashlib
+import queue
+import threading
+import functools
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 import joblib
 import numpy as np
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from transformers import pipeline
+from bert_backends import BACKENDS, load_bert_classifier
+from phrase_matcher import PhraseMatcher
+from prediction_cache import PredictionCache, normalize_query
+from metrics import MetricsRegistry, SamplingProfiler
+from features import build_feature_matrix, build_linear_features
+from risk_aggregator import DAY, RiskAggregator, connect_shared, serve_shared
+from prediction_sink import PredictionSink, mongo_collection_factory, search_document
+from model_bundle import load_bundle, resolve_bundle
 
 app = Flask(__name__)
-vectorizer = None
-scaler = None
-rf_model = None
-analyzer = None
-bert_classifier = None
-
-def load_models():
-    global vectorizer, scaler, rf_model, analyzer, bert_classifier
-    
-    print("Loading models...")
-    vectorizer = joblib.load('./models/vectorizer.joblib')
-    scaler = joblib.load('./models/scaler.joblib')
-    rf_model = joblib.load('./models/rf_model.joblib')
-    analyzer = SentimentIntensityAnalyzer()
-
-    bert_classifier = pipeline(
-        "text-classification",
-        model="./models/bert_model",
-        tokenizer="./models/bert_model",
-        truncation=True
+
+def _env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+# Opt-in dynamic micro-batching of concurrent /predict calls
+MICROBATCH_ENABLED = _env_flag('PREDICT_MICROBATCH')
+MICROBATCH_MAX_SIZE = int(os.environ.get('PREDICT_MAX_BATCH_SIZE', 32))
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get('PREDICT_MAX_WAIT_MS', 5))
+
+# Admission control (off while PREDICT_MAX_CONCURRENCY is 0): at most PREDICT_MAX_CONCURRENCY requests
+# score at once and at most PREDICT_MAX_QUEUE wait behind them. Requests that would wait past
+# PREDICT_TIMEOUT_MS get a fast 503 with Retry-After, and requests still scoring when it runs out a 504
+# (fully scored results still go into the prediction cache for the retry). With PREDICT_DEGRADE, requests admitted
+# while PREDICT_DEGRADE_QUEUE or more are waiting (or short on time) skip BERT instead and are
+# decided by the linear pre-model (or the forest with zeroed BERT features when there is none).
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get('PREDICT_MAX_CONCURRENCY', 0))
+ADMISSION_MAX_QUEUE = int(os.environ.get('PREDICT_MAX_QUEUE', 16))
+ADMISSION_TIMEOUT_MS = float(os.environ.get('PREDICT_TIMEOUT_MS', 0))
+DEGRADE_ENABLED = _env_flag('PREDICT_DEGRADE')
+DEGRADE_QUEUE = int(os.environ.get('PREDICT_DEGRADE_QUEUE', max(1, ADMISSION_MAX_QUEUE // 2)))
+# torch intra-op threads per process; defaults to CPU count / PREDICT_MAX_CONCURRENCY when that is set
+TORCH_THREADS = int(os.environ.get('PREDICT_TORCH_THREADS', 0))
+
+# /predict_stream scores NDJSON lines in batches of up to PREDICT_STREAM_BATCH_SIZE, flushing a
+# partial batch once its first line has waited PREDICT_STREAM_MAX_WAIT_MS for more input
+STREAM_BATCH_SIZE = int(os.environ.get('PREDICT_STREAM_BATCH_SIZE', 64))
+STREAM_MAX_WAIT_MS = float(os.environ.get('PREDICT_STREAM_MAX_WAIT_MS', 20))
+STREAM_MAX_LINE_BYTES = 64 * 1024
+# /predict_batch rejects requests with more items than this with 413
+PREDICT_BATCH_MAX_ITEMS = int(os.environ.get('PREDICT_BATCH_MAX_ITEMS', 256))
+
+LEXICON_PATH = os.environ.get(
+    'LEXICON_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lexicons.json')
+)
+
+# Prediction cache keyed on (normalized query, model version); size 0 disables it
+CACHE_MAX_ENTRIES = int(os.environ.get('PREDICT_CACHE_SIZE', 10000))
+CACHE_MAX_BYTES = int(os.environ.get('PREDICT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_TTL = float(os.environ.get('PREDICT_CACHE_TTL', 3600))
+
+# Per-user rolling risk aggregates behind /user_risk/<userId>: counts decayed with a 1-day and a 7-day
+# half-life, at most RISK_MAX_USERS users, users idle for RISK_IDLE_DAYS dropped, state snapshotted
+# to RISK_SNAPSHOT_PATH every RISK_SNAPSHOT_INTERVAL seconds (0 disables snapshots)
+RISK_AGGREGATION_ENABLED = _env_flag('RISK_AGGREGATION', True)
+RISK_MAX_USERS = int(os.environ.get('RISK_MAX_USERS', 100_000))
+RISK_IDLE_DAYS = float(os.environ.get('RISK_IDLE_DAYS', 30))
+RISK_SNAPSHOT_PATH = os.environ.get('RISK_SNAPSHOT_PATH', './state/user_risk.npz')
+RISK_SNAPSHOT_INTERVAL = float(os.environ.get('RISK_SNAPSHOT_INTERVAL', 300))
+RISK_HORIZONS = ('recent', 'baseline')
+RISK_HALF_LIVES = (DAY, 7 * DAY)
+
+# Optional write-behind persistence of served predictions to MongoDB, off while MONGO_URI is unset
+# (memory:// keeps them in an in-process stand-in). Documents use the Node `searches` schema fields.
+MONGO_URI = os.environ.get('MONGO_URI')
+MONGO_DB = os.environ.get('MONGO_DB')
+MONGO_COLLECTION = os.environ.get('MONGO_COLLECTION', 'predictions')
+MONGO_SINK_BATCH_SIZE = int(os.environ.get('MONGO_SINK_BATCH_SIZE', 500))
+MONGO_SINK_FLUSH_MS = float(os.environ.get('MONGO_SINK_FLUSH_MS', 1000))
+MONGO_SINK_MAX_BUFFER = int(os.environ.get('MONGO_SINK_MAX_BUFFER', 10_000))
+
+# cProfile one in every PROFILE_SAMPLE_EVERY requests (0 disables) and dump stats to PROFILE_DIR
+PROFILE_SAMPLE_EVERY = int(os.environ.get('PROFILE_SAMPLE_EVERY', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', './profiles')
+
+# BERT inference backend: torch-fp32 (transformers pipeline), onnx-fp32 or onnx-int8
+BERT_BACKEND = os.environ.get('BERT_BACKEND', 'torch-fp32')
+# BERT_MODEL_DIR=./models/student_model serves the distilled student in BERT's place
+BERT_MODEL_DIR = os.environ.get('BERT_MODEL_DIR', './models/bert_model')
+BERT_ONNX_DIR = os.environ.get('BERT_ONNX_DIR', './models/bert_onnx')
+if BERT_BACKEND not in BACKENDS:
+    raise ValueError(f"BERT_BACKEND must be one of {BACKENDS}, got '{BERT_BACKEND}'")
+# Texts per BERT forward pass, whatever the size of the request batch
+BERT_BATCH_SIZE = max(1, int(os.environ.get('BERT_BATCH_SIZE', 64)))
+
+# Early-exit cascade: rules, then the TF-IDF + sentiment linear pre-model, then BERT + forest
+CASCADE_ENABLED = _env_flag('PREDICT_CASCADE')
+CASCADE_LINEAR_THRESHOLD = float(os.environ.get('PREDICT_CASCADE_THRESHOLD', 0.9))
+LINEAR_MODEL_PATH = './models/linear_model.joblib'
+
+# Versioned bundle written by train.py (a bundle directory, or a root whose CURRENT file names one).
+# Without one the individual ./models/*.joblib files and BERT directories are loaded.
+MODEL_BUNDLE = os.environ.get('MODEL_BUNDLE', './models/bundle')
+WARMUP_QUERIES = ["warm up", "i feel alone and nobody talks to me"]
+
+# Hot reload: POST /admin/reload (enabled only when MODEL_ADMIN_TOKEN is set) and/or
+# polling the artifacts every MODEL_WATCH_INTERVAL seconds (0 disables)
+MODEL_ADMIN_TOKEN = os.environ.get('MODEL_ADMIN_TOKEN')
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 0))
+
+MODEL_PATHS = [
+    './models/vectorizer.joblib',
+    './models/scaler.joblib',
+    './models/rf_model.joblib',
+    LINEAR_MODEL_PATH,
+    BERT_MODEL_DIR if BERT_BACKEND == 'torch-fp32' else BERT_ONNX_DIR
+]
+
+class ModelSet:
+    """Every model one prediction needs, loaded and warmed together and swapped in as a unit."""
+
+    def __init__(self, vectorizer, scaler, rf_model, linear_model, analyzer, bert_classifier, version, fingerprint):
+        self.vectorizer = vectorizer
+        self.scaler = scaler
+        self.rf_model = rf_model
+        self.linear_model = linear_model
+        self.analyzer = analyzer
+        self.bert_classifier = bert_classifier
+        self.version = version
+        # What the artifacts on disk looked like when this set was loaded; the file watcher compares against it
+        self.fingerprint = fingerprint
+        self.load_seconds = None
+
+# The live ModelSet. Requests read it once and use that snapshot throughout, so a
+# reload only replaces this reference and in-flight requests finish on the old set.
+# Models are loaded by load_models()/ensure_loaded(), not at import; the first /ready call starts a
+# background load when nothing else has, and reports ready once they are warm.
+models = None
+startup_seconds = None
+_load_lock = threading.RLock()
+
+prediction_cache = None
+if CACHE_MAX_ENTRIES > 0:
+    prediction_cache = PredictionCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL)
+
+metrics_registry = MetricsRegistry()
+REQUEST_COUNT = metrics_registry.counter('predict_requests_total', 'Prediction HTTP requests handled', ('endpoint', 'status'))
+REQUEST_LATENCY = metrics_registry.histogram('predict_request_latency_seconds', 'End-to-end prediction request latency', ('endpoint',))
+IN_FLIGHT = metrics_registry.gauge('predict_in_flight_requests', 'Prediction requests currently being handled', ('endpoint',))
+STAGE_LATENCY = metrics_registry.histogram('predict_stage_latency_seconds', 'Latency of each prediction pipeline stage per batch', ('stage',))
+CASCADE_DECISIONS = metrics_registry.counter('predict_cascade_decisions_total', 'Queries decided by each cascade tier', ('tier',))
+BATCH_SIZE = metrics_registry.histogram('predict_batch_size', 'Number of queries per pipeline batch', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+SHED = metrics_registry.counter('predict_shed_total', 'Requests rejected by admission control', ('endpoint', 'reason'))
+DEGRADED = metrics_registry.counter('predict_degraded_total', 'Requests (or stream batches) scored without BERT under overload', ('endpoint',))
+TIMEOUTS = metrics_registry.counter('predict_timeouts_total', 'Requests that ran past PREDICT_TIMEOUT_MS', ('endpoint',))
+profiler = SamplingProfiler(PROFILE_SAMPLE_EVERY, PROFILE_DIR)
+
+def _cache_metrics():
+    if prediction_cache is None:
+        return []
+    stats = prediction_cache.stats()
+    return [
+        ('predict_cache_hits_total', 'counter', 'Prediction cache hits', stats['hits']),
+        ('predict_cache_misses_total', 'counter', 'Prediction cache misses', stats['misses']),
+        ('predict_cache_evictions_total', 'counter', 'Prediction cache LRU evictions', stats['evictions']),
+        ('predict_cache_expirations_total', 'counter', 'Prediction cache TTL expirations', stats['expirations']),
+        ('predict_cache_entries', 'gauge', 'Entries held in the prediction cache', stats['entries']),
+        ('predict_cache_bytes', 'gauge', 'Approximate bytes held in the prediction cache', stats['bytes'])
+    ]
+metrics_registry.add_collector(_cache_metrics)
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _startup_metrics():
+    if startup_seconds is None:
+        return []
+    return [
+        ('model_startup_seconds', 'gauge', 'Seconds taken to load and warm up the models', startup_seconds),
+        ('process_peak_rss_megabytes', 'gauge', 'Peak resident set size of this process', _peak_rss_mb())
+    ]
+metrics_registry.add_collector(_startup_metrics)
+
+# serve.py sets worker_reload in its workers to a callable asking the parent to reload the models
+# and replace every worker
+_import_pid = os.getpid()
+worker_reload = None
+
+risk_aggregator = None
+if RISK_AGGREGATION_ENABLED:
+    risk_aggregator = RiskAggregator(5, RISK_HALF_LIVES, RISK_MAX_USERS, RISK_IDLE_DAYS * DAY)
+    restored = risk_aggregator.restore(RISK_SNAPSHOT_PATH)
+    if restored:
+        print(f"Restored risk aggregates for {restored} users from {RISK_SNAPSHOT_PATH}")
+
+# Each process keeps its own aggregates unless share_risk_aggregates() is called before forking:
+# serve.py does, so its workers all update one aggregate held by a manager process (which also
+# takes the snapshots) instead of each holding part of every user's history. A gunicorn --preload
+# setup would need the same call before the workers are forked.
+_risk_manager = None
+_risk_proxy = None
+
+def share_risk_aggregates():
+    global _risk_manager
+    if risk_aggregator is None or _risk_manager is not None:
+        return
+    _risk_manager = serve_shared(risk_aggregator, RISK_SNAPSHOT_PATH, RISK_SNAPSHOT_INTERVAL)
+    atexit.register(_stop_risk_manager, os.getpid())
+
+def _stop_risk_manager(owner_pid):
+    if os.getpid() != owner_pid:
+        return
+    if RISK_SNAPSHOT_INTERVAL > 0:
+        try:
+            users = _risk_aggregates().snapshot(RISK_SNAPSHOT_PATH)
+            print(f"Saved risk aggregates for {users} users to {RISK_SNAPSHOT_PATH}")
+        except Exception as e:
+            print(f"Risk aggregate snapshot failed: {e}")
+    _risk_manager.shutdown()
+
+def _risk_aggregates():
+    """This process's aggregates, or its connection to the shared ones (made once per process)."""
+    global _risk_proxy
+    if _risk_manager is None:
+        return risk_aggregator
+    if _risk_proxy is None or _risk_proxy[0] != os.getpid():
+        _risk_proxy = (os.getpid(), connect_shared(_risk_manager.address))
+    return _risk_proxy[1]
+
+def _risk_metrics():
+    if risk_aggregator is None:
+        return []
+    try:
+        stats = _risk_aggregates().stats()
+    except Exception as e:
+        print(f"Risk aggregate stats unavailable: {e}")
+        return []
+    return [
+        ('user_risk_tracked_users', 'gauge', 'Users with rolling risk aggregates in memory', stats['users']),
+        ('user_risk_evictions_total', 'counter', 'Users dropped from the risk aggregates (idle or over capacity)',
+         stats['evictions'])
+    ]
+metrics_registry.add_collector(_risk_metrics)
+
+prediction_sink = None
+if MONGO_URI:
+    prediction_sink = PredictionSink(
+        mongo_collection_factory(MONGO_URI, MONGO_COLLECTION, MONGO_DB),
+        MONGO_SINK_MAX_BUFFER, MONGO_SINK_BATCH_SIZE, MONGO_SINK_FLUSH_MS / 1000.0
     )
-    print("Models loaded successfully")
-load_models()
 
-def get_bert_probs(text):
+def _sink_metrics():
+    if prediction_sink is None:
+        return []
+    stats = prediction_sink.stats()
+    return [
+        ('prediction_sink_enqueued_total', 'counter', 'Predictions queued for MongoDB', stats['enqueued']),
+        ('prediction_sink_written_total', 'counter', 'Predictions written to MongoDB', stats['written']),
+        ('prediction_sink_dropped_total', 'counter', 'Predictions dropped because the sink buffer was full', stats['dropped']),
+        ('prediction_sink_failed_total', 'counter', 'Predictions lost after exhausting write retries', stats['failed']),
+        ('prediction_sink_retries_total', 'counter', 'Retried MongoDB batch writes', stats['retries']),
+        ('prediction_sink_buffered', 'gauge', 'Predictions waiting to be written', stats['buffered'])
+    ]
+metrics_registry.add_collector(_sink_metrics)
+
+def shutdown(timeout=5.0):
+    """Flush buffered predictions before the process exits."""
+    if prediction_sink is not None and not prediction_sink.flush(timeout):
+        print(f"Prediction sink still had {prediction_sink.stats()['buffered']} documents buffered at shutdown")
+atexit.register(shutdown)
+MODEL_RELOADS = metrics_registry.counter('model_reloads_total', 'Hot model reload attempts', ('status',))
+
+def _artifact_version(paths, backend):
+    digest = hashlib.sha1(backend.encode())
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        else:
+            files = [path]
+        for file_path in files:
+            stat = os.stat(file_path)
+            digest.update(f"{file_path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:12]
+
+def _artifact_fingerprint():
+    bundle_dir = resolve_bundle(MODEL_BUNDLE)
+    if bundle_dir is not None:
+        return bundle_dir
+    return _artifact_version(MODEL_PATHS, BERT_BACKEND)
+
+def load_model_set(warm=True):
+    """Load and warm up a complete ModelSet from the bundle, or the individual model files without one."""
+    start = time.perf_counter()
+    fingerprint = _artifact_fingerprint()
+    bundle_dir = resolve_bundle(MODEL_BUNDLE)
+    if bundle_dir is not None:
+        manifest, components = load_bundle(bundle_dir)
+        vectorizer = components['vectorizer']
+        scaler = components['scaler']
+        rf_model = components['rf_model']
+        linear_model = components.get('linear_model')
+        # An explicit BERT_MODEL_DIR (e.g. the distilled student) still overrides the bundled BERT
+        bert_dir = os.environ.get('BERT_MODEL_DIR', os.path.join(bundle_dir, manifest['bert']))
+        onnx_dir = os.path.join(bundle_dir, manifest['onnx']) if manifest['onnx'] else BERT_ONNX_DIR
+        version = manifest['version']
+        if 'BERT_MODEL_DIR' in os.environ:
+            version += '-' + _artifact_version([bert_dir], BERT_BACKEND)
+        print(f"Using model bundle {bundle_dir} (created {manifest['created']})")
+    else:
+        vectorizer = joblib.load('./models/vectorizer.joblib')
+        scaler = joblib.load('./models/scaler.joblib')
+        rf_model = joblib.load('./models/rf_model.joblib')
+        linear_model = joblib.load(LINEAR_MODEL_PATH) if os.path.exists(LINEAR_MODEL_PATH) else None
+        bert_dir, onnx_dir = BERT_MODEL_DIR, BERT_ONNX_DIR
+        version = fingerprint
+    if CASCADE_ENABLED and linear_model is None:
+        print("Cascade enabled but no linear pre-model was found; only the rules tier can skip BERT")
+
+    model_set = ModelSet(
+        vectorizer, scaler, rf_model, linear_model,
+        SentimentIntensityAnalyzer(),
+        load_bert_classifier(BERT_BACKEND, bert_dir, onnx_dir),
+        version, fingerprint
+    )
+    if warm:
+        warm_up(model_set)
+    model_set.load_seconds = time.perf_counter() - start
+    return model_set
+
+def _configure_torch_threads():
+    threads = TORCH_THREADS
+    if threads <= 0 and ADMISSION_MAX_CONCURRENCY > 0:
+        threads = max(1, (os.cpu_count() or 1) // ADMISSION_MAX_CONCURRENCY)
+    if threads > 0:
+        import torch
+        # Concurrent requests each running BERT with every core oversubscribe the CPU
+        torch.set_num_threads(threads)
+
+def load_models(warm=True):
+    """Load (or reload) the models and swap them in once warm; requests in flight finish on the old set.
+
+    Processes that fork afterwards (serve.py, rescore.py) pass ``warm=False``
+    and call warm_up() in each child: torch's thread pools don't survive fork.
+    """
+    global models, startup_seconds
+
+    with _load_lock:
+        print("Loading models...")
+        if models is None:
+            _configure_torch_threads()
+        new_models = load_model_set(warm)
+        previous, models = models, new_models
+        if startup_seconds is None:
+            startup_seconds = new_models.load_seconds
+        # Entries are keyed by version, so this only frees memory held for the old models
+        if prediction_cache is not None and previous is not None and previous.version != new_models.version:
+            prediction_cache.clear()
+    print(f"Models ready in {new_models.load_seconds:.2f}s (version {new_models.version}, "
+          f"BERT backend {BERT_BACKEND}, peak RSS {_peak_rss_mb():.0f}MB)")
+    return new_models
+
+def reload_models(warm=True):
     try:
-        preds = bert_classifier(text)
-        probs = [0] * 5
-        for p in preds:
-            label_idx = int(p['label'].split('_')[-1])
-            probs[label_idx] = p['score']
-        return probs
+        load_models(warm)
+    except Exception as e:
+        MODEL_RELOADS.inc(status='error')
+        print(f"Model reload failed, still serving version {models.version if models else None}: {e}")
+        raise
+    MODEL_RELOADS.inc(status='ok')
+
+def _reload_in_background():
+    try:
+        reload_models()
+    except Exception:
+        pass  # already logged and counted; the current set keeps serving
+
+def ensure_loaded():
+    """The live ModelSet, loading it on first use."""
+    current = models
+    if current is None:
+        with _load_lock:
+            current = models or load_models()
+    if MODEL_WATCH_INTERVAL > 0:
+        _ensure_watcher()
+    return current
+
+def warm_up(model_set=None):
+    # One pass through every model so page faults on the mapped arrays and
+    # torch's first-call setup happen before the set serves a real request
+    model_set = model_set or ensure_loaded()
+    sentiment = model_set.scaler.transform(
+        np.array([model_set.analyzer.polarity_scores(q)['compound'] for q in WARMUP_QUERIES]).reshape(-1, 1)
+    )
+    X_text = model_set.vectorizer.transform(WARMUP_QUERIES)
+    bert_probs = np.array(get_bert_probs_batch(WARMUP_QUERIES, model_set), dtype=float)
+    model_set.rf_model.predict_proba(build_feature_matrix(X_text, sentiment, bert_probs))
+    if model_set.linear_model is not None:
+        model_set.linear_model.predict_proba(build_linear_features(X_text, sentiment))
+
+_watcher_pid = None
+_watcher_lock = threading.Lock()
+
+def _ensure_watcher():
+    # Started lazily per process, since threads don't survive fork. serve.py workers don't use it:
+    # there the parent watches the artifacts and replaces its workers, keeping BERT shared.
+    global _watcher_pid
+    if _watcher_pid == os.getpid():
+        return
+    with _watcher_lock:
+        if _watcher_pid != os.getpid():
+            threading.Thread(target=_watch_artifacts, daemon=True).start()
+            _watcher_pid = os.getpid()
+
+def _watch_artifacts():
+    failed = None
+    while True:
+        time.sleep(MODEL_WATCH_INTERVAL)
+        fingerprint = _artifact_fingerprint()
+        if models is None or fingerprint in (models.fingerprint, failed):
+            continue
+        print("Model artifacts changed on disk, reloading...")
+        try:
+            reload_models()
+        except Exception:
+            # Keep serving the current set; a broken artifact is only retried once it changes again
+            failed = fingerprint
+
+phrase_matcher = PhraseMatcher.from_file(LEXICON_PATH)
+
+risk_map = {
+    0: "No_Risk",
+    1: "Depression",
+    2: "Suicide",
+    3: "Isolation",
+    4: "Anxiety"
+}
+
+def _bert_probs_from_preds(preds):
+    if isinstance(preds, dict):
+        preds = [preds]
+    probs = [0] * 5
+    for p in preds:
+        label_idx = int(p['label'].split('_')[-1])
+        probs[label_idx] = p['score']
+    return probs
+
+def get_bert_probs(text, model_set=None):
+    model_set = model_set or ensure_loaded()
+    try:
+        return _bert_probs_from_preds(model_set.bert_classifier(text))
     except Exception as e:
         print(f"BERT prediction error: {e}")
         return [0] * 5
 
+def get_bert_probs_batch(texts, model_set=None):
+    # Forward passes of at most BERT_BATCH_SIZE texts instead of one pipeline call per text,
+    # so peak activation memory does not grow with the size of the request
+    model_set = model_set or ensure_loaded()
+    texts = list(texts)
+    try:
+        probs = []
+        for start in range(0, len(texts), BERT_BATCH_SIZE):
+            chunk = texts[start:start + BERT_BATCH_SIZE]
+            preds = model_set.bert_classifier(chunk, batch_size=len(chunk))
+            probs.extend(_bert_probs_from_preds(p) for p in preds)
+        return probs
+    except Exception as e:
+        print(f"BERT batch prediction error: {e}")
+        return [[0] * 5 for _ in texts]
+
+# Highest-priority risk phrase category wins when the rules override the model
+RULE_PRIORITY = (
+    ('suicide', 2),
+    ('depression', 1),
+    ('isolation', 3),
+    ('anxiety', 4)
+)
+
+def apply_risk_rules(query, prediction, confidence, match=None):
+    if match is None:
+        match = phrase_matcher.match(query.lower().strip())
+
+    if ('no_risk' in match.categories or match.common_object_hated) and 'suicide' not in match.categories:
+        prediction = 0
+
+    if confidence < 0.7:
+        if match.negated:
+            prediction = 0
+        else:
+            for category, label in RULE_PRIORITY:
+                if category in match.categories:
+                    prediction = label
+                    break
+            if match.has_negation and prediction > 0:
+                prediction = min(prediction, 1)
+
+    if len(query.strip()) < 3:
+        prediction = 0
+    return prediction
+
+def rule_tier_label(query, match):
+    """Label the rule block would assign whatever the models predict, or None if the models matter.
+
+    Very short queries are always No_Risk, as are no-risk phrases or a hated
+    everyday object when no risk phrase of any category is present.
+    """
+    if len(query.strip()) < 3:
+        return 0
+    if ('no_risk' in match.categories or match.common_object_hated) and \
+            not any(category in match.categories for category, _ in RULE_PRIORITY):
+        return 0
+    return None
+
+def run_pipeline(queries, cascade=CASCADE_ENABLED, linear_threshold=CASCADE_LINEAR_THRESHOLD, model_set=None,
+                 use_bert=True):
+    """Run the full prediction pipeline over a list of queries in one pass.
+
+    With ``cascade`` the rules and the linear pre-model settle the queries they
+    are sure about, and only the remaining ones go through BERT + the forest.
+    Every stage uses ``model_set`` (default: the live set at call time).
+    Without ``use_bert`` (degraded mode under overload) the linear pre-model
+    decides every remaining query; only when there is none does the forest get
+    zeroed BERT features, as it does when BERT inference fails.
+    """
+    if not queries:
+        return []
+    model_set = model_set or ensure_loaded()
+    analyzer, scaler, vectorizer = model_set.analyzer, model_set.scaler, model_set.vectorizer
+    linear_model, rf_model = model_set.linear_model, model_set.rf_model
+    BATCH_SIZE.observe(len(queries))
+
+    with STAGE_LATENCY.time(stage='vader'):
+        sentiment_scores = np.array([analyzer.polarity_scores(q)['compound'] for q in queries])
+        sentiment_scaled = scaler.transform(sentiment_scores.reshape(-1, 1))
+
+    with STAGE_LATENCY.time(stage='tfidf'):
+        X_text = vectorizer.transform(queries)
+
+    predictions = np.zeros(len(queries), dtype=int)
+    confidences = np.ones(len(queries))
+    tiers = np.full(len(queries), 'bert' if use_bert else 'degraded', dtype=object)
+    matches = [phrase_matcher.match(q.lower().strip()) for q in queries]
+    pending = np.arange(len(queries))
+
+    if cascade:
+        with STAGE_LATENCY.time(stage='cascade'):
+            decided = np.array([rule_tier_label(q, m) is not None for q, m in zip(queries, matches)])
+            tiers[decided] = 'rules'
+            pending = np.flatnonzero(~decided)
+
+            if linear_model is not None and len(pending):
+                linear_probas = linear_model.predict_proba(
+                    build_linear_features(X_text[pending], sentiment_scaled[pending])
+                )
+                linear_confidence = linear_probas.max(axis=1)
+                confident = linear_confidence >= linear_threshold
+                settled = pending[confident]
+                predictions[settled] = linear_model.classes_[linear_probas.argmax(axis=1)][confident]
+                confidences[settled] = linear_confidence[confident]
+                tiers[settled] = 'linear'
+                pending = pending[~confident]
+
+    if len(pending) and not use_bert and linear_model is not None:
+        # The forest was trained on real BERT probabilities, so all-zero BERT columns are out of
+        # distribution for it; the linear model needs only the TF-IDF and sentiment features
+        with STAGE_LATENCY.time(stage='linear'):
+            linear_probas = linear_model.predict_proba(
+                build_linear_features(X_text[pending], sentiment_scaled[pending])
+            )
+            predictions[pending] = linear_model.classes_[linear_probas.argmax(axis=1)]
+            confidences[pending] = linear_probas.max(axis=1)
+            pending = pending[:0]
+
+    if len(pending):
+        if use_bert:
+            with STAGE_LATENCY.time(stage='bert'):
+                bert_probs = np.array(get_bert_probs_batch([queries[i] for i in pending], model_set), dtype=float)
+        else:
+            bert_probs = np.zeros((len(pending), 5))
+
+        with STAGE_LATENCY.time(stage='forest'):
+            features = build_feature_matrix(X_text[pending], sentiment_scaled[pending], bert_probs)
+
+            probas = rf_model.predict_proba(features)
+            predictions[pending] = np.argmax(probas, axis=1)
+            confidences[pending] = np.max(probas, axis=1)
+
+    results = []
+    with STAGE_LATENCY.time(stage='rules'):
+        for query, match, sentiment_score, prediction, confidence, tier in zip(
+                queries, matches, sentiment_scores, predictions, confidences, tiers):
+            if tier != 'rules':
+                prediction = apply_risk_rules(query, int(prediction), confidence, match)
+            results.append({
+                'sentimentScore': float(sentiment_score),
+                'predictedLabel': int(prediction),
+                'confidence': float(confidence),
+                'decidedBy': tier,
+                'modelVersion': model_set.version
+            })
+    if cascade:
+        for tier, count in zip(*np.unique(tiers, return_counts=True)):
+            CASCADE_DECISIONS.inc(int(count), tier=tier)
+    return results
+
+def _cache_key(query, model_set):
+    return (normalize_query(query), model_set.version)
+
+def lookup_cached(query, model_set=None):
+    if prediction_cache is None:
+        return None
+    return prediction_cache.get(_cache_key(query, model_set or ensure_loaded()))
+
+def _score_and_cache(queries, model_set=None):
+    model_set = model_set or ensure_loaded()
+    keys = [_cache_key(q, model_set) for q in queries]
+    unique = dict(zip(keys, queries))
+    scored = dict(zip(unique, run_pipeline(list(unique.values()), model_set=model_set)))
+    if prediction_cache is not None:
+        for key, result in scored.items():
+            prediction_cache.put(key, result)
+    return [scored[key] for key in keys]
+
+def score_queries(queries, degraded=False):
+    """Score queries, serving repeats from the prediction cache and the rest through run_pipeline.
+
+    ``degraded`` skips BERT for the cache misses; those results are not cached.
+    """
+    model_set = ensure_loaded()
+    if prediction_cache is None:
+        return run_pipeline(queries, model_set=model_set, use_bert=not degraded)
+
+    results = [lookup_cached(q, model_set) for q in queries]
+    missing = [q for q, result in zip(queries, results) if result is None]
+    if missing:
+        if degraded:
+            scored = iter(run_pipeline(missing, model_set=model_set, use_bert=False))
+        else:
+            scored = iter(_score_and_cache(missing, model_set))
+        results = [result if result is not None else next(scored) for result in results]
+    return results
+
+def build_response(user_id, query, result):
+    return {
+        'userId': user_id,
+        'query': query,
+        'predictedRisk': risk_map.get(result['predictedLabel'], "Unknown"),
+        'sentimentScore': result['sentimentScore'],
+        'predictedLabel': result['predictedLabel'],
+        'confidence': result['confidence'],
+        'decidedBy': result['decidedBy'],
+        'modelVersion': result['modelVersion']
+    }
+
+_snapshot_pid = None
+_snapshot_lock = threading.Lock()
+
+def _ensure_snapshotter():
+    # Started lazily, like the file watcher; shared aggregates are snapshotted by their manager instead
+    global _snapshot_pid
+    if _snapshot_pid == os.getpid():
+        return
+    with _snapshot_lock:
+        if _snapshot_pid != os.getpid():
+            threading.Thread(target=_snapshot_risk_aggregates, daemon=True).start()
+            _snapshot_pid = os.getpid()
+
+def _snapshot_risk_aggregates():
+    while True:
+        time.sleep(RISK_SNAPSHOT_INTERVAL)
+        try:
+            risk_aggregator.snapshot(RISK_SNAPSHOT_PATH)
+        except Exception as e:
+            print(f"Risk aggregate snapshot failed: {e}")
+
+def record_prediction(item, response):
+    """Fold a served prediction into the user's risk aggregates and queue it for MongoDB; never blocks."""
+    user_id = response['userId']
+    if risk_aggregator is not None and user_id:
+        try:
+            _risk_aggregates().update(str(user_id), response['predictedLabel'], response['confidence'])
+        except Exception as e:
+            print(f"Risk aggregate update failed: {e}")
+        if RISK_SNAPSHOT_INTERVAL > 0 and _risk_manager is None:
+            _ensure_snapshotter()
+    if prediction_sink is not None:
+        prediction_sink.submit(search_document(response, item.get('metadata')))
+
+class MicroBatcher:
+    """Collects single queries from concurrent requests and scores them together.
+
+    A batch is flushed once it reaches ``max_batch_size`` items or the first
+    queued item has waited ``max_wait_ms``. The worker thread is started lazily
+    (and restarted after a fork) so the batcher is safe to create at import time.
+    """
+
+    def __init__(self, score_fn, max_batch_size=32, max_wait_ms=5):
+        self.score_fn = score_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = None
+        self._worker_pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._worker_pid == pid:
+            return self._queue
+        with self._lock:
+            if self._worker_pid != pid:
+                self._queue = queue.Queue()
+                worker = threading.Thread(target=self._run, args=(self._queue,), daemon=True)
+                worker.start()
+                self._worker_pid = pid
+        return self._queue
+
+    def submit(self, query):
+        future = Future()
+        self._ensure_worker().put((query, future))
+        return future
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            results = self.score_fn([query for query, _ in batch])
+        except Exception as e:
+            print(f"Micro-batch prediction error: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Bounds concurrent scoring and the queue in front of it, and sheds requests that can't finish in time.
+
+    Expected queueing delay is estimated from a moving average of how long an
+    admitted request holds its slot. A request is rejected up front when the
+    queue is full or the estimate already exceeds its deadline, rather than
+    after it has waited and timed out anyway.
+    """
+
+    def __init__(self, max_concurrency, max_queue, timeout_ms=0, degrade=False, degrade_queue=1):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout_ms / 1000.0 if timeout_ms > 0 else None
+        self.degrade = degrade
+        self.degrade_queue = degrade_queue
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+        self.service_time = 0.0
+
+    def _expected_wait(self, position):
+        return math.ceil(position / self.max_concurrency) * self.service_time
+
+    def _retry_after(self):
+        return max(1, math.ceil(self._expected_wait(self.waiting + self.active)))
+
+    def check(self):
+        """Raise Overloaded if a new request would be rejected right now, without queueing it."""
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                raise Overloaded('queue_full', self._retry_after())
+
+    def acquire(self, deadline=None, shed=True):
+        """Wait for a scoring slot; returns True when the request should run degraded (without BERT)."""
+        with self._lock:
+            position = self.waiting + (self.active >= self.max_concurrency)
+            if shed and self.waiting >= self.max_queue:
+                raise Overloaded('queue_full', self._retry_after())
+            if shed and deadline is not None and time.monotonic() + self._expected_wait(position) > deadline:
+                raise Overloaded('deadline', self._retry_after())
+            self.waiting += 1
+        try:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            if not self._slots.acquire(timeout=timeout):
+                raise Overloaded('deadline', self._retry_after())
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        with self._lock:
+            self.active += 1
+            short_on_time = deadline is not None and deadline - time.monotonic() < self.service_time
+            return self.degrade and (self.waiting >= self.degrade_queue or short_on_time)
+
+    def release(self, seconds, degraded):
+        with self._lock:
+            self.active -= 1
+            if not degraded:
+                self.service_time = seconds if self.service_time == 0.0 else 0.8 * self.service_time + 0.2 * seconds
+        self._slots.release()
+
+admission = None
+if ADMISSION_MAX_CONCURRENCY > 0:
+    admission = AdmissionController(
+        ADMISSION_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE, ADMISSION_TIMEOUT_MS, DEGRADE_ENABLED, DEGRADE_QUEUE
+    )
+
+def _admission_metrics():
+    if admission is None:
+        return []
+    return [
+        ('predict_admission_waiting', 'gauge', 'Requests queued for a scoring slot', admission.waiting),
+        ('predict_admission_active', 'gauge', 'Requests holding a scoring slot', admission.active),
+        ('predict_admission_service_seconds', 'gauge', 'Moving average of full-pipeline slot hold time',
+         admission.service_time)
+    ]
+metrics_registry.add_collector(_admission_metrics)
+
+micro_batcher = None
+if MICROBATCH_ENABLED:
+    micro_batcher = MicroBatcher(_score_and_cache, MICROBATCH_MAX_SIZE, MICROBATCH_MAX_WAIT_MS)
+
+def instrumented(endpoint):
+    """Record request count, latency and in-flight gauge, and sample cProfile stats for an endpoint."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            status = 500
+            start = time.perf_counter()
+            with IN_FLIGHT.track_inprogress(endpoint=endpoint), profiler.maybe_profile(endpoint):
+                try:
+                    response = view(*args, **kwargs)
+                    status = response[1] if isinstance(response, tuple) else getattr(response, 'status_code', 200)
+                    return response
+                finally:
+                    REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+                    REQUEST_COUNT.inc(endpoint=endpoint, status=status)
+        return wrapper
+    return decorator
+
+def _overloaded_response(error):
+    return jsonify({'error': 'Service overloaded, retry later', 'reason': error.reason}), 503, \
+        {'Retry-After': str(error.retry_after)}
+
+def admitted(endpoint):
+    """Run the view inside an admission slot; g.degraded tells it to skip BERT, g.deadline when to give up."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            g.degraded = False
+            g.deadline = time.monotonic() + ADMISSION_TIMEOUT_MS / 1000.0 if ADMISSION_TIMEOUT_MS > 0 else None
+            if admission is None:
+                return view(*args, **kwargs)
+            try:
+                g.degraded = admission.acquire(g.deadline)
+            except Overloaded as e:
+                SHED.inc(endpoint=endpoint, reason=e.reason)
+                return _overloaded_response(e)
+            if g.degraded:
+                DEGRADED.inc(endpoint=endpoint)
+            start = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                admission.release(time.perf_counter() - start, g.degraded)
+        return wrapper
+    return decorator
+
+def _timed_out(endpoint):
+    # Scoring can't be interrupted, so a request that overran its deadline is answered once it is done
+    if g.deadline is None or time.monotonic() <= g.deadline:
+        return False
+    TIMEOUTS.inc(endpoint=endpoint)
+    return True
+
 # Prediction endpoint
 @app.route('/predict', methods=['POST'])
+@instrumented('predict')
+@admitted('predict')
 def predict():
     data = request.json
     query = data.get('query', '')
     user_id = data.get('userId', '')
 
-   
-    sentiment_score = analyzer.polarity_scores(query)['compound']
-    sentiment_scaled = scaler.transform([[sentiment_score]])[0][0]
-    
-    X_text = vectorizer.transform([query]).toarray()[0]
-
-    bert_probs = get_bert_probs(query)
-
-    features = np.concatenate((
-        X_text,              
-        [sentiment_scaled],  
-        bert_probs         
-    )).reshape(1, -1)
-    
-    probas = rf_model.predict_proba(features)[0]
-    prediction = np.argmax(probas)
-    confidence = np.max(probas)
-    
-    risk_map = {
-        0: "No_Risk",
-        1: "Depression",
-        2: "Suicide",
-        3: "Isolation",
-        4: "Anxiety"
-    }
-    
-    isolation_phrases = {
-        'alone', 'lonely', 'isolated', 'no friends', 'by myself', 
-        'no one', 'separated', 'left out', 'abandoned', 'no family',
-        'no one to talk to', 'all by myself', 'feel alone', 'feel lonely',
-        'nobody cares', 'no one cares', 'no one understands', 'no one is there'
-    }
-    depression_phrases = {
-        'sad', 'unhappy', 'miserable', 'hopeless', 'empty',
-        'depressed', 'worthless', 'useless', 'tired', 'exhausted',
-        'can\'t go on', 'giving up', 'life is meaningless', 'no point',
-        'nothing matters', 'feel nothing', 'numb inside', 'lost all hope',
-        'can\'t be happy', 'never happy'
-    }
-    suicide_phrases = {
-        'end it all', 'kill myself', 'suicide', 'want to die',
-        'end my life', 'take my life', 'end everything',
-        'don\'t want to live', 'can\'t take it anymore',
-        'better off dead', 'no reason to live', 'want to end it',
-        'tired of living', 'can\'t go on living', 'end it now',
-        'don\'t want to be here', 'wish i was dead'
-    }
-    anxiety_phrases = {
-        'anxious', 'nervous', 'worried', 'afraid', 'panicked',
-        'scared', 'fear', 'stressed', 'overwhelmed', 'panic',
-        'anxiety', 'panic attack', 'can\'t breathe', 'heart racing',
-        'constantly worried', 'always anxious', 'scared all the time',
-        'fear of', 'scared of', 'afraid of', 'nervous about'
-    }
-    
-    no_risk_phrases = {
-        'ice cream', 'icecream', 'chocolate', 'pizza', 'food',
-        'movie', 'music', 'game', 'play', 'sports', 'dark',
-        'laptop', 'computer', 'phone', 'tv', 'television',
-        'vegetables', 'vegetarian', 'non-vegetarian', 'food', 'drink',
-        'coffee', 'tea', 'soda', 'sleep', 'bed', 'room', 'house'
-    }
-    
-    common_objects = {
-        'homework', 'work', 'job', 'school', 'college', 'class', 'exam',
-        'test', 'boss', 'teacher', 'professor', 'traffic', 'rain', 'weather',
-        'monday', 'alarm', 'alarm clock', 'waking up', 'morning', 'waking up early',
-        'vegetables', 'broccoli', 'spinach', 'homework', 'chores', 'cleaning',
-        'doing dishes', 'laundry', 'shopping', 'grocery shopping', 'cooking',
-        'waking up early', 'getting up early', 'waking up', 'getting up',
-        'going to work', 'going to school', 'commute', 'driving', 'public transport',
-        'bus', 'train', 'subway', 'taxi', 'uber', 'lyft', 'traffic jam',
-        'waiting in line', 'long lines', 'waiting', 'waiting room', 'doctor\'s office',
-        'dentist', 'doctor', 'hospital', 'clinic', 'pharmacy', 'drugstore',
-        'shopping mall', 'mall', 'crowds', 'loud music', 'noise', 'loud noises',
-        'bright lights', 'strong smells', 'perfume', 'cologne', 'cigarette smoke',
-        'cigars', 'cigarettes', 'vaping', 'vape', 'e-cigarette', 'e-cig',
-        'social media', 'facebook', 'instagram', 'twitter', 'tiktok', 'snapchat',
-        'youtube', 'netflix', 'hulu', 'disney+', 'disney plus', 'amazon prime',
-        'prime video', 'hbo max', 'hbo', 'peacock', 'apple tv', 'apple tv+',
-        'paramount+', 'paramount plus', 'peacock', 'peacock tv', 'peacock streaming',
-        'streaming', 'binge watching', 'binge-watching', 'binge watch', 'binge-watch',
-        'binge watching shows', 'binge-watching shows', 'binge watch shows', 'binge-watch shows'
-    }
-    
-    query_lower = query.lower().strip()
-    negation_phrases = {"won't", "wouldn't", "can't", "don't", "didn't", "not", "no longer", "never", 
-                        "nothing", "nobody", "nowhere", "neither", "nor", "none", "hardly", "scarcely",
-                        "barely", "no one", "n't", "cannot", "can not", "no more"}
-    
-    def has_negation_before_phrase(text, phrase_set):
-        words = text.split()
-        for i, word in enumerate(words):
-            if word in phrase_set:
-                for j in range(max(0, i-3), i):
-                    if words[j] in negation_phrases:
-                        return True
-        return False
-    def is_common_object_hated(text):
-        words = text.split()
-        if 'hate' in words:
-            hate_index = words.index('hate')
-            next_words = words[hate_index+1:min(hate_index+3, len(words))]
-            next_phrase = ' '.join(next_words)
-            if any(obj in next_phrase for obj in common_objects):
-                return True
-            if len(next_words) > 0 and next_words[0] in {'when', 'that', 'how', 'what'}:
+    if micro_batcher is not None and not g.degraded:
+        result = lookup_cached(query)
+        if result is None:
+            timeout = None if g.deadline is None else max(g.deadline - time.monotonic(), 0.0)
+            try:
+                result = micro_batcher.submit(query).result(timeout=timeout)
+            except FutureTimeoutError:
+                TIMEOUTS.inc(endpoint='predict')
+                return jsonify({'error': 'Prediction timed out'}), 504
+    else:
+        result = score_queries([query], degraded=g.degraded)[0]
+        if _timed_out('predict'):
+            return jsonify({'error': 'Prediction timed out'}), 504
+    response = build_response(user_id, query, result)
+    record_prediction(data, response)
+    return jsonify(response)
+
+# Batched prediction endpoint: accepts a list of {userId, query} items (or {"items": [...]})
+@app.route('/predict_batch', methods=['POST'])
+@instrumented('predict_batch')
+@admitted('predict_batch')
+def predict_batch():
+    data = request.json
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return jsonify({'error': 'Expected a list of {userId, query} objects'}), 400
+    if len(items) > PREDICT_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {PREDICT_BATCH_MAX_ITEMS} items per request, got {len(items)}'}), 413
+
+    queries = [item.get('query', '') for item in items]
+    for index, query in enumerate(queries):
+        if not isinstance(query, str):
+            return jsonify({'error': f'items[{index}].query must be a string, got {type(query).__name__}'}), 400
+    results = score_queries(queries, degraded=g.degraded)
+    if _timed_out('predict_batch'):
+        return jsonify({'error': 'Prediction timed out'}), 504
+    responses = [
+        build_response(item.get('userId', ''), query, result)
+        for item, query, result in zip(items, queries, results)
+    ]
+    for item, response in zip(items, responses):
+        record_prediction(item, response)
+    return jsonify({'results': responses})
+
+_STREAM_END = object()
+
+def _read_ndjson(stream, lines, stop):
+    """Reader thread for /predict_stream: parse request lines onto the bounded ``lines`` queue.
+
+    Each entry is (line_number, item, error). The queue bounds how far reading
+    runs ahead of scoring; ``stop`` is set when the response is closed early.
+    """
+    def put(entry):
+        while not stop.is_set():
+            try:
+                lines.put(entry, timeout=0.1)
                 return True
-                
+            except queue.Full:
+                pass
         return False
-    
-    if (any(phrase in query_lower for phrase in no_risk_phrases) or 
-        is_common_object_hated(query_lower)):
-        if not any(phrase in query_lower for phrase in suicide_phrases):
-            prediction = 0  
-
-    if confidence < 0.7:  
-        negated_depression = has_negation_before_phrase(query_lower, depression_phrases)
-        negated_suicide = has_negation_before_phrase(query_lower, suicide_phrases)
-        negated_isolation = has_negation_before_phrase(query_lower, isolation_phrases)
-        negated_anxiety = has_negation_before_phrase(query_lower, anxiety_phrases)
-        
-        if negated_depression or negated_suicide or negated_isolation or negated_anxiety:
-            prediction = 0  
+
+    line_number = 0
+    try:
+        while not stop.is_set():
+            line = stream.readline(STREAM_MAX_LINE_BYTES + 1)
+            if not line:
+                break
+            line_number += 1
+            if len(line) > STREAM_MAX_LINE_BYTES:
+                while line and not line.endswith(b'\n'):
+                    line = stream.readline(STREAM_MAX_LINE_BYTES)
+                entry = (line_number, None, f'Line longer than {STREAM_MAX_LINE_BYTES} bytes')
+            elif not line.strip():
+                continue
+            else:
+                try:
+                    item = json.loads(line)
+                    if not isinstance(item, dict):
+                        entry = (line_number, None, 'Expected a {userId, query} object')
+                    elif not isinstance(item.get('query'), str):
+                        entry = (line_number, None, "Missing or non-string 'query'")
+                    else:
+                        entry = (line_number, item, None)
+                except ValueError:
+                    entry = (line_number, None, 'Invalid JSON')
+            if not put(entry):
+                return
+    except Exception as e:
+        put((line_number + 1, None, f'Error reading request body: {e}'))
+    put(_STREAM_END)
+
+def _score_stream_batch(batch):
+    valid = [(item.get('userId', ''), item['query']) for _, item, error in batch if error is None]
+    degraded = False
+    if admission is not None:
+        # Streams never shed mid-way; each batch waits for a slot and only holds it while scoring
+        degraded = admission.acquire(shed=False)
+        if degraded:
+            DEGRADED.inc(endpoint='predict_stream')
+    start = time.perf_counter()
+    try:
+        scored = iter(score_queries([query for _, query in valid], degraded=degraded))
+    finally:
+        if admission is not None:
+            admission.release(time.perf_counter() - start, degraded)
+    valid = iter(valid)
+    for line_number, item, error in batch:
+        if error is not None:
+            record = {'line': line_number, 'error': error}
         else:
-            has_any_negation = any(neg in query_lower.split() for neg in negation_phrases)
-            
-            if any(phrase in query_lower for phrase in suicide_phrases):
-                prediction = 2  
-            elif any(phrase in query_lower for phrase in depression_phrases):
-                prediction = 1  
-            elif any(phrase in query_lower for phrase in isolation_phrases):
-                prediction = 3  
-            elif any(phrase in query_lower for phrase in anxiety_phrases):
-                prediction = 4  
-            if has_any_negation and prediction > 0:
-                prediction = min(prediction, 1) 
-    
-    if len(query.strip()) < 3:
-        prediction = 0  
-    predicted_risk = risk_map.get(prediction, "Unknown")
-    
+            user_id, query = next(valid)
+            record = build_response(user_id, query, next(scored))
+            record_prediction(item, record)
+            if 'id' in item:
+                record['id'] = item['id']
+        yield json.dumps(record) + '\n'
+
+# Streaming prediction endpoint: NDJSON {userId, query[, id]} lines in, one NDJSON result per line out,
+# in input order. Memory stays bounded by the batch size however long the stream is.
+@app.route('/predict_stream', methods=['POST'])
+@instrumented('predict_stream')
+def predict_stream():
+    if admission is not None:
+        try:
+            admission.check()
+        except Overloaded as e:
+            SHED.inc(endpoint='predict_stream', reason=e.reason)
+            return _overloaded_response(e)
+    ensure_loaded()
+    stream = request.stream
+    lines = queue.Queue(maxsize=STREAM_BATCH_SIZE * 2)
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_ndjson, args=(stream, lines, stop), daemon=True)
+    max_wait = STREAM_MAX_WAIT_MS / 1000.0
+
+    def generate():
+        reader.start()
+        try:
+            finished = False
+            while not finished:
+                entry = lines.get()
+                if entry is _STREAM_END:
+                    break
+                batch = [entry]
+                deadline = time.monotonic() + max_wait
+                while len(batch) < STREAM_BATCH_SIZE:
+                    try:
+                        entry = lines.get(timeout=max(deadline - time.monotonic(), 0.0001))
+                    except queue.Empty:
+                        break
+                    if entry is _STREAM_END:
+                        finished = True
+                        break
+                    batch.append(entry)
+                yield from _score_stream_batch(batch)
+        finally:
+            stop.set()
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+# Rolling risk profile of one user, read from the in-memory aggregates without touching history
+@app.route('/user_risk/<user_id>', methods=['GET'])
+def user_risk(user_id):
+    if risk_aggregator is None:
+        return jsonify({'error': 'Risk aggregation is disabled'}), 404
+    try:
+        aggregate = _risk_aggregates().get(user_id)
+    except Exception as e:
+        print(f"Risk aggregate lookup failed: {e}")
+        return jsonify({'error': 'Risk aggregates unavailable'}), 503
+    if aggregate is None:
+        return jsonify({'userId': user_id, 'known': False}), 404
+
+    classes = {}
+    for label, name in risk_map.items():
+        horizons = {
+            horizon: {
+                'count': float(aggregate['counts'][h, label]),
+                'share': float(aggregate['shares'][h, label]),
+                'meanConfidence': float(aggregate['mean_confidence'][h, label])
+            }
+            for h, horizon in enumerate(RISK_HORIZONS)
+        }
+        baseline_share = horizons['baseline']['share']
+        # > 1 when the class makes up more of the last day or so than of the last weeks
+        horizons['trend'] = horizons['recent']['share'] / baseline_share if baseline_share > 0 else None
+        classes[name] = horizons
     return jsonify({
         'userId': user_id,
-        'query': query,
-        'predictedRisk': predicted_risk,
-        'sentimentScore': float(sentiment_score),
-        'predictedLabel': int(prediction),
-        'confidence': float(confidence)
+        'known': True,
+        'lastSeen': aggregate['last_update'],
+        'halfLifeDays': {horizon: float(half_life / DAY) for horizon, half_life in zip(RISK_HORIZONS, RISK_HALF_LIVES)},
+        'risks': classes
     })
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    if prediction_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'modelVersion': models.version if models else None, **prediction_cache.stats()})
+
+_ready_loader = None
+_ready_loader_lock = threading.Lock()
+
+def _load_for_readiness():
+    try:
+        ensure_loaded()
+    except Exception as e:
+        print(f"Background model load failed: {e}")
+
+def _start_background_load():
+    # Under flask run or gunicorn nothing calls load_models() up front, so the first probe starts it;
+    # a failed load is retried by the next probe
+    global _ready_loader
+    with _ready_loader_lock:
+        if _ready_loader is None or not _ready_loader.is_alive():
+            _ready_loader = threading.Thread(target=_load_for_readiness, daemon=True)
+            _ready_loader.start()
+
+# Readiness probe: 200 only once models are loaded and warmed up; the first call starts loading them
+@app.route('/ready', methods=['GET'])
+def ready():
+    current = models
+    if current is None:
+        _start_background_load()
+        return jsonify({'ready': False, 'loading': True}), 503
+    return jsonify({
+        'ready': True,
+        'modelVersion': current.version,
+        'startupSeconds': startup_seconds,
+        'peakRssMb': _peak_rss_mb()
+    })
+
+# Load the current artifacts in the background and swap them in once warm. Under serve.py the
+# parent reloads once and replaces its workers (?wait is ignored there); other multi-worker
+# servers are refused, since reloading would only reach the worker that took the request.
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    if not MODEL_ADMIN_TOKEN:
+        return jsonify({'error': 'Reload endpoint disabled; set MODEL_ADMIN_TOKEN to enable it'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), MODEL_ADMIN_TOKEN):
+        return jsonify({'error': 'Invalid admin token'}), 403
+
+    previous_version = models.version if models else None
+    if worker_reload is not None:
+        worker_reload()
+        return jsonify({'reloading': True, 'restartingWorkers': True, 'modelVersion': previous_version}), 202
+    if os.getpid() != _import_pid or int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+        return jsonify({'error': 'Reload would only reach this worker; restart the server, or run serve.py '
+                                 'which reloads every worker'}), 409
+
+    wait = request.args.get('wait', '').lower() in ('1', 'true', 'yes')
+    if wait:
+        try:
+            reload_models()
+        except Exception as e:
+            return jsonify({'reloaded': False, 'error': str(e), 'modelVersion': previous_version}), 500
+        return jsonify({'reloaded': True, 'previousVersion': previous_version, 'modelVersion': models.version})
+    threading.Thread(target=_reload_in_background, daemon=True).start()
+    return jsonify({'reloading': True, 'modelVersion': previous_version}), 202
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    # Development server only; the reloader would import this module (and load every model) twice.
+    # For production use serve.py, which loads models once and forks workers.
+    load_models()
+    app.run(host='0.0.0.0', port=5001, debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,139 @@
+import os
+import json
+import hashlib
+import joblib
+import numpy as np
+from scipy import sparse
+
+def _update(digest, value):
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        digest.update(f"ndarray:{value.dtype.str}:{value.shape}".encode())
+        if value.dtype == object:
+            for item in value.ravel():
+                _update(digest, item)
+        else:
+            digest.update(value.tobytes())
+    elif sparse.issparse(value):
+        value = value.tocsr()
+        digest.update(f"sparse:{value.shape}".encode())
+        for part in (value.data, value.indices, value.indptr):
+            _update(digest, part)
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"seq:{len(value)}".encode())
+        for item in value:
+            _update(digest, item)
+    elif isinstance(value, dict):
+        digest.update(json.dumps(value, sort_keys=True, default=str).encode())
+    elif isinstance(value, bytes):
+        digest.update(b"bytes:" + value)
+    else:
+        digest.update(f"{type(value).__name__}:{value}".encode())
+    digest.update(b"|")
+
+def content_key(*parts):
+    """Stable hash of stage inputs: strings, dicts, lists, numpy arrays and scipy sparse matrices."""
+    digest = hashlib.sha256()
+    for part in parts:
+        _update(digest, part)
+    return digest.hexdigest()[:20]
+
+def row_hashes(texts):
+    return np.array([hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest() for text in texts], dtype='S16')
+
+class RowCache:
+    """Per-row feature vectors keyed by a hash of the row's text.
+
+    Stored as two .npy files (row hashes and a float matrix), so a re-run only
+    computes rows whose text has not been seen under this namespace before.
+    """
+
+    def __init__(self, directory, width):
+        self.directory = directory
+        self.width = width
+        self._hashes_path = os.path.join(directory, 'hashes.npy')
+        self._values_path = os.path.join(directory, 'values.npy')
+
+    def lookup(self, texts, compute):
+        hashes = row_hashes(texts)
+        if os.path.exists(self._hashes_path):
+            known_hashes = np.load(self._hashes_path)
+            known_values = np.load(self._values_path)
+        else:
+            known_hashes = np.empty(0, dtype='S16')
+            known_values = np.empty((0, self.width))
+        index = {h: i for i, h in enumerate(known_hashes)}
+
+        missing = [i for i, h in enumerate(hashes) if h not in index]
+        if missing:
+            unique_missing = list({hashes[i]: i for i in missing}.values())
+            new_values = np.asarray(compute([texts[i] for i in unique_missing]), dtype=np.float64).reshape(-1, self.width)
+            os.makedirs(self.directory, exist_ok=True)
+            known_hashes = np.concatenate([known_hashes, hashes[unique_missing]])
+            known_values = np.concatenate([known_values, new_values])
+            np.save(self._hashes_path, known_hashes)
+            np.save(self._values_path, known_values)
+            index = {h: i for i, h in enumerate(known_hashes)}
+        print(f"[cache] {os.path.basename(self.directory)}: {len(texts) - len(missing)} rows reused, {len(missing)} computed")
+        return known_values[[index[h] for h in hashes]]
+
+class ArtifactCache:
+    """On-disk cache of training artifacts addressed by the hash of their inputs."""
+
+    def __init__(self, root='./cache', enabled=True):
+        self.root = root
+        self.enabled = enabled
+
+    def path(self, stage, key):
+        return os.path.join(self.root, stage, key)
+
+    def cached(self, stage, key, compute):
+        """Load a joblib artifact for (stage, key) or compute and store it."""
+        path = self.path(stage, key) + '.joblib'
+        if self.enabled and os.path.exists(path):
+            print(f"[cache] {stage}: hit ({key})")
+            return joblib.load(path)
+        value = compute()
+        if self.enabled:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            joblib.dump(value, path)
+            print(f"[cache] {stage}: stored ({key})")
+        return value
+
+    def cached_encodings(self, stage, key, compute):
+        """Load or compute tokenizer output (dict of int sequences), stored ragged as flat arrays + lengths."""
+        path = self.path(stage, key) + '.npz'
+        if self.enabled and os.path.exists(path):
+            print(f"[cache] {stage}: hit ({key})")
+            with np.load(path) as stored:
+                names = [name[:-len('.values')] for name in stored.files if name.endswith('.values')]
+                return {
+                    name: [seq.tolist() for seq in np.split(stored[f'{name}.values'], np.cumsum(stored[f'{name}.lengths'])[:-1])]
+                    for name in names
+                }
+        encodings = compute()
+        if self.enabled:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            arrays = {}
+            for name, sequences in encodings.items():
+                arrays[f'{name}.values'] = np.fromiter((t for seq in sequences for t in seq), dtype=np.int32)
+                arrays[f'{name}.lengths'] = np.array([len(seq) for seq in sequences], dtype=np.int32)
+            np.savez(path, **arrays)
+            print(f"[cache] {stage}: stored ({key})")
+        return encodings
+
+    def model_dir(self, stage, key):
+        """Directory for a cached model, and whether a complete copy is already there."""
+        path = self.path(stage, key)
+        return path, self.enabled and os.path.exists(os.path.join(path, '.complete'))
+
+    @staticmethod
+    def mark_complete(path):
+        with open(os.path.join(path, '.complete'), 'w') as f:
+            f.write('ok\n')
+
+    def cached_rows(self, stage, namespace, texts, width, compute):
+        """Per-row values for ``texts``, only computing rows not cached under (stage, namespace)."""
+        if not self.enabled or namespace is None:
+            return np.asarray(compute(texts), dtype=np.float64).reshape(-1, width)
+        return RowCache(self.path(stage, namespace), width).lookup(texts, compute)
@@ -1,29 +1,122 @@
+import csv
+import argparse
+import numpy as np
 import pandas as pd
-import random
-from collections import defaultdict
-
-print("Loading and balancing dataset...")
-df = pd.read_csv('data1.csv')
-
-def balance_dataset(df, target_col='label'):
-    class_groups = defaultdict(list)
-    for _, row in df.iterrows():
-        class_groups[row[target_col]].append(row['text'])
-    max_size = max(len(texts) for texts in class_groups.values())
-    balanced_data = []
-    for class_name, texts in class_groups.items():
-        if len(texts) < max_size:
-            sampled_texts = random.choices(texts, k=max_size)
+
+STRATEGIES = ('oversample', 'undersample', 'ratio')
+
+def read_chunks(path, target_col, chunksize, encoding):
+    for chunk in pd.read_csv(path, usecols=['text', target_col], chunksize=chunksize, encoding=encoding):
+        yield chunk.dropna(subset=['text', target_col])
+
+def count_classes(path, target_col='label', chunksize=100_000, encoding='utf-8'):
+    counts = pd.Series(dtype='int64')
+    for chunk in read_chunks(path, target_col, chunksize, encoding):
+        counts = counts.add(chunk[target_col].value_counts(), fill_value=0)
+    return counts.astype('int64').to_dict()
+
+def class_targets(counts, strategy='oversample', ratio=1.0):
+    """Number of output rows per class for a resampling strategy.
+
+    oversample grows every class to the majority size, undersample shrinks every
+    class to the minority size, and ratio resizes every class to ``ratio`` times
+    the majority size.
+    """
+    if strategy == 'oversample':
+        size = max(counts.values())
+    elif strategy == 'undersample':
+        size = min(counts.values())
+    elif strategy == 'ratio':
+        size = max(1, int(round(max(counts.values()) * ratio)))
+    else:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {STRATEGIES}")
+    return {label: size for label in counts}
+
+def repeat_counts(counts, targets, rng=None):
+    """How many times each row of every class is written, drawn from the pass-1 class counts.
+
+    Classes at or above their target keep a uniform sample of ``target`` rows
+    (each written once); smaller classes keep every row and draw the remaining
+    rows with replacement. Costs one small integer per input row.
+    """
+    rng = rng or np.random.default_rng()
+    repeats = {}
+    for label, count in counts.items():
+        target = targets[label]
+        if target <= count:
+            rows = np.zeros(count, dtype=np.uint8)
+            rows[rng.choice(count, target, replace=False)] = 1
         else:
-            sampled_texts = random.sample(texts, max_size)
-        balanced_data.extend([{'text': text, target_col: class_name} for text in sampled_texts])
+            rows = 1 + np.bincount(rng.integers(0, count, target - count), minlength=count)
+            rows = rows.astype(np.min_scalar_type(rows.max()))
+        repeats[label] = rows
+    return repeats
+
+def write_balanced(input_path, repeats, output_path, target_col='label', chunksize=100_000, encoding='utf-8',
+                   shuffle_buffer=200_000, rng=None):
+    """Stream the input a second time, writing each row as often as ``repeats`` says, in shuffled order.
+
+    Each chunk's output rows join a buffer of at most ``shuffle_buffer`` rows
+    that is permuted, and whatever overflows it is written, so memory stays
+    bounded by the buffer plus one chunk. Rows far more than a buffer apart in
+    the input are only partially mixed.
+    """
+    rng = rng or np.random.default_rng()
+    seen = dict.fromkeys(repeats, 0)
+    buffered_text = np.empty(0, dtype=object)
+    buffered_label = np.empty(0, dtype=object)
+    written = 0
+
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['text', target_col])
+        for chunk in read_chunks(input_path, target_col, chunksize, encoding):
+            times = np.zeros(len(chunk), dtype=np.int64)
+            for label, positions in chunk.groupby(target_col, sort=False).indices.items():
+                times[positions] = repeats[label][seen[label]:seen[label] + len(positions)]
+                seen[label] += len(positions)
+            pool_text = np.concatenate([buffered_text, np.repeat(chunk['text'].to_numpy(dtype=object), times)])
+            pool_label = np.concatenate([buffered_label, np.repeat(chunk[target_col].to_numpy(dtype=object), times)])
+            order = rng.permutation(len(pool_text))
+            overflow = order[shuffle_buffer:]
+            writer.writerows(zip(pool_text[overflow], pool_label[overflow]))
+            written += len(overflow)
+            buffered_text, buffered_label = pool_text[order[:shuffle_buffer]], pool_label[order[:shuffle_buffer]]
+        order = rng.permutation(len(buffered_text))
+        writer.writerows(zip(buffered_text[order], buffered_label[order]))
+        written += len(order)
+    return written
 
-    balanced_df = pd.DataFrame(balanced_data)
-    balanced_df = balanced_df.sample(frac=1, random_state=42).reset_index(drop=True)
-    
-    return balanced_df
-balanced_df = balance_dataset(df)
+def balance_dataset(input_path, output_path, target_col='label', strategy='oversample', ratio=1.0,
+                    seed=42, chunksize=100_000, encoding='utf-8', shuffle_buffer=200_000):
+    rng = np.random.default_rng(seed)
+    counts = count_classes(input_path, target_col, chunksize, encoding)
+    if not counts:
+        raise ValueError(f"No labelled rows found in {input_path}")
+    targets = class_targets(counts, strategy, ratio)
+    repeats = repeat_counts(counts, targets, rng)
+    write_balanced(input_path, repeats, output_path, target_col, chunksize, encoding, shuffle_buffer, rng)
+    return counts, targets
 
-balanced_counts = balanced_df['label'].value_counts()
-print(balanced_counts)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Resample a text/label CSV to a balanced class distribution")
+    parser.add_argument('--input', default='data1.csv')
+    parser.add_argument('--output', default='balanced_data.csv')
+    parser.add_argument('--target-col', default='label')
+    parser.add_argument('--strategy', choices=STRATEGIES, default='oversample')
+    parser.add_argument('--ratio', type=float, default=1.0,
+                        help="With --strategy ratio, size of every class relative to the largest class")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunksize', type=int, default=100_000, help="Rows read per chunk")
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--shuffle-buffer', type=int, default=200_000,
+                        help="Rows held in memory to shuffle the output")
+    args = parser.parse_args()
 
+    print("Loading and balancing dataset...")
+    counts, targets = balance_dataset(
+        args.input, args.output, args.target_col, args.strategy, args.ratio,
+        args.seed, args.chunksize, args.encoding, args.shuffle_buffer
+    )
+    print(pd.DataFrame({'original': counts, 'balanced': targets}))
+    print(f"Balanced dataset written to {args.output}")
@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import subprocess
+import numpy as np
+import pandas as pd
+from features import build_feature_matrix
+
+DEFAULT_DATA = ['balanced_data.csv', 'data1.csv']
+
+def load_queries(paths, limit=None):
+    queries = []
+    for path in paths:
+        df = pd.read_csv(path, encoding='ISO-8859-1')
+        queries.extend(df['text'].dropna().astype(str).str.strip().tolist())
+    return queries[:limit] if limit else queries
+
+def summarize(latencies):
+    if not latencies:
+        return {'count': 0}
+    values = np.array(latencies) * 1000.0
+    return {
+        'count': int(len(values)),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max())
+    }
+
+def run_metadata():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'bert_backend': os.environ.get('BERT_BACKEND', 'torch-fp32')
+    }
+
+def _http_sender(base_url):
+    import requests
+
+    session = requests.Session()
+
+    def send(path, payload):
+        response = session.post(base_url + path, json=payload, timeout=60)
+        return response.status_code
+    return send
+
+def _in_process_sender():
+    import app as service
+
+    service.ensure_loaded()
+    client = service.app.test_client()
+
+    def send(path, payload):
+        return client.post(path, json=payload).status_code
+    return send
+
+def load_test(queries, url=None, concurrency=8, rate=0.0, total=None, batch_size=1):
+    """Replay queries against /predict (or /predict_batch) and report throughput and latency percentiles.
+
+    With ``rate`` > 0 requests are issued on a fixed schedule and latency is
+    measured from the scheduled send time, so queueing delay is not hidden.
+    """
+    if url is None:
+        import app as service
+        service.ensure_loaded()  # load models once before worker threads start
+        service.app.testing = True
+
+    total = total or len(queries)
+    if batch_size > 1:
+        path = '/predict_batch'
+        payloads = [
+            {'items': [{'userId': 'bench', 'query': queries[(i * batch_size + j) % len(queries)]} for j in range(batch_size)]}
+            for i in range(total)
+        ]
+    else:
+        path = '/predict'
+        payloads = [{'userId': 'bench', 'query': queries[i % len(queries)]} for i in range(total)]
+
+    latencies = []
+    errors = []
+    next_index = [0]
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def worker():
+        send = _http_sender(url) if url else _in_process_sender()
+        while True:
+            with lock:
+                index = next_index[0]
+                if index >= total:
+                    return
+                next_index[0] += 1
+            scheduled = start + index / rate if rate > 0 else time.perf_counter()
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                status = send(path, payloads[index])
+            except Exception as e:
+                status = repr(e)
+            elapsed = time.perf_counter() - scheduled
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    return {
+        'kind': 'load',
+        'target': url or 'in-process',
+        'endpoint': path,
+        'concurrency': concurrency,
+        'rate': rate,
+        'batch_size': batch_size,
+        'requests': total,
+        'errors': len(errors),
+        'wall_seconds': wall,
+        'requests_per_second': total / wall if wall else 0.0,
+        'queries_per_second': total * batch_size / wall if wall else 0.0,
+        'latency': summarize(latencies)
+    }
+
+def _time_stage(fn, batches, repeat):
+    per_batch = []
+    for _ in range(repeat):
+        for batch in batches:
+            start = time.perf_counter()
+            fn(batch)
+            per_batch.append(time.perf_counter() - start)
+    return per_batch
+
+def stage_benchmarks(queries, batch_size=1, repeat=3, stages=None):
+    """Time each pipeline stage in isolation over the same query batches."""
+    import app as service
+
+    models = service.ensure_loaded()
+    batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+    sentiment = models.scaler.transform(
+        np.array([models.analyzer.polarity_scores(q)['compound'] for q in queries]).reshape(-1, 1)
+    )
+    bert_probs = np.array(service.get_bert_probs_batch(queries, models), dtype=float)
+    features = build_feature_matrix(models.vectorizer.transform(queries), sentiment, bert_probs)
+    feature_batches = [features[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+
+    stage_fns = {
+        'rules': lambda batch: [service.apply_risk_rules(q, 1, 0.5) for q in batch],
+        'vader': lambda batch: [models.analyzer.polarity_scores(q)['compound'] for q in batch],
+        'tfidf': models.vectorizer.transform,
+        'bert': lambda batch: service.get_bert_probs_batch(batch, models),
+        'forest': models.rf_model.predict_proba,
+        'pipeline': lambda batch: service.run_pipeline(batch, model_set=models)
+    }
+    results = {}
+    for name in stages or stage_fns:
+        inputs = feature_batches if name == 'forest' else batches
+        stage_fns[name](inputs[0])  # warm-up
+        per_batch = _time_stage(stage_fns[name], inputs, repeat)
+        results[name] = {
+            'per_batch': summarize(per_batch),
+            'per_query_mean_ms': float(np.sum(per_batch) * 1000.0 / (len(queries) * repeat)),
+            'queries_per_second': float(len(queries) * repeat / np.sum(per_batch))
+        }
+    return {
+        'kind': 'stages',
+        'batch_size': batch_size,
+        'repeat': repeat,
+        'queries': len(queries),
+        'stages': results
+    }
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+def compare(baseline_path, candidate_path):
+    """Print the relative change of every numeric metric between two benchmark JSON files."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    base = _flatten('', {k: v for k, v in baseline.items() if k != 'meta'}, {})
+    cand = _flatten('', {k: v for k, v in candidate.items() if k != 'meta'}, {})
+    print(f"baseline:  {baseline_path} {baseline.get('meta', {})}")
+    print(f"candidate: {candidate_path} {candidate.get('meta', {})}")
+    for key in sorted(set(base) & set(cand)):
+        change = (cand[key] - base[key]) / base[key] * 100 if base[key] else float('nan')
+        print(f"  {key:<45} {base[key]:>14.4f} {cand[key]:>14.4f} {change:>+9.1f}%")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load tests and micro-benchmarks for the prediction service")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    load_parser = subparsers.add_parser('load', help="Replay dataset queries against the Flask app")
+    load_parser.add_argument('--url', help="Base URL of a running service, e.g. http://localhost:5001 (default: in-process)")
+    load_parser.add_argument('--concurrency', type=int, default=8)
+    load_parser.add_argument('--rate', type=float, default=0.0, help="Target requests per second (0 = as fast as possible)")
+    load_parser.add_argument('--requests', type=int, help="Number of requests to send (default: one per query)")
+    load_parser.add_argument('--batch-size', type=int, default=1, help="Send /predict_batch requests of this size")
+    load_parser.add_argument('--no-cache', action='store_true', help="Disable the prediction cache for in-process runs")
+
+    stages_parser = subparsers.add_parser('stages', help="Time each pipeline stage in isolation")
+    stages_parser.add_argument('--batch-size', type=int, default=1)
+    stages_parser.add_argument('--repeat', type=int, default=3)
+    stages_parser.add_argument('--stages', nargs='+', choices=['rules', 'vader', 'tfidf', 'bert', 'forest', 'pipeline'])
+
+    for sub in (load_parser, stages_parser):
+        sub.add_argument('--data', nargs='+', default=DEFAULT_DATA)
+        sub.add_argument('--limit', type=int, help="Only use the first N queries")
+        sub.add_argument('--output', help="Write results as JSON to this file")
+
+    compare_parser = subparsers.add_parser('compare', help="Diff two benchmark JSON files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        compare(args.baseline, args.candidate)
+        return
+
+    queries = load_queries(args.data, args.limit)
+    if args.command == 'load':
+        if args.no_cache:
+            os.environ['PREDICT_CACHE_SIZE'] = '0'
+        result = load_test(queries, args.url, args.concurrency, args.rate, args.requests, args.batch_size)
+    else:
+        result = stage_benchmarks(queries, args.batch_size, args.repeat, args.stages)
+    result['meta'] = run_metadata()
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import os
+import inspect
+import argparse
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoTokenizer, BertForSequenceClassification, pipeline
+
+BACKENDS = ('torch-fp32', 'onnx-fp32', 'onnx-int8')
+ONNX_FP32_FILE = 'model.onnx'
+ONNX_INT8_FILE = 'model-int8.onnx'
+
+def export_onnx(model_dir, output_dir, opset=14):
+    """Export the fine-tuned BERT classifier to ONNX with dynamic batch/sequence axes."""
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = BertForSequenceClassification.from_pretrained(model_dir)
+    model.eval()
+
+    sample = tokenizer(["export sample"], return_tensors='pt')
+    # Inputs are traced positionally, so they must follow forward()'s parameter order
+    # (input_ids, attention_mask, token_type_ids), not the tokenizer's key order
+    input_names = [name for name in inspect.signature(model.forward).parameters if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['logits'] = {0: 'batch'}
+
+    onnx_path = os.path.join(output_dir, ONNX_FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            onnx_path,
+            input_names=input_names,
+            output_names=['logits'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset
+        )
+    tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+    print(f"ONNX model saved to: {onnx_path}")
+    return onnx_path
+
+def quantize_onnx(onnx_path, output_path):
+    """Write a dynamically quantized (int8 weights) copy of an ONNX graph."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QInt8)
+    print(f"Quantized int8 model saved to: {output_path}")
+    return output_path
+
+def _softmax(logits):
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+class OnnxTextClassifier:
+    """ONNX Runtime stand-in for the transformers text-classification pipeline.
+
+    Calling it returns the same top-1 ``{'label', 'score'}`` structure as the
+    pipeline so ``get_bert_probs`` works unchanged with either backend.
+    """
+
+    def __init__(self, model_path, tokenizer_dir, max_length=512, intra_op_threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+        self.id2label = AutoConfig.from_pretrained(tokenizer_dir).id2label
+        self.max_length = max_length
+
+    def predict_proba(self, texts, batch_size=32):
+        probs = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + batch_size],
+                truncation=True,
+                max_length=self.max_length,
+                padding=True,
+                return_tensors='np'
+            )
+            feed = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+            logits = self.session.run(['logits'], feed)[0]
+            probs.append(_softmax(logits))
+        return np.concatenate(probs, axis=0)
+
+    def __call__(self, inputs, batch_size=None, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        if not texts:
+            return []
+        probs = self.predict_proba(texts, batch_size=batch_size or len(texts))
+        return [
+            {'label': self.id2label[int(idx)], 'score': float(row[idx])}
+            for row, idx in zip(probs, probs.argmax(axis=1))
+        ]
+
+def load_bert_classifier(backend, model_dir, onnx_dir):
+    if backend == 'torch-fp32':
+        return pipeline(
+            "text-classification",
+            model=model_dir,
+            tokenizer=model_dir,
+            truncation=True
+        )
+    if backend == 'onnx-fp32':
+        return OnnxTextClassifier(os.path.join(onnx_dir, ONNX_FP32_FILE), onnx_dir)
+    if backend == 'onnx-int8':
+        return OnnxTextClassifier(os.path.join(onnx_dir, ONNX_INT8_FILE), onnx_dir)
+    raise ValueError(f"Unknown BERT backend '{backend}', expected one of {BACKENDS}")
+
+def predict_proba_batched(model, tokenizer, texts, batch_size=64):
+    """Softmax probabilities for every text, computed in mini-batches under torch.no_grad().
+
+    Texts are processed in length order so each batch pads to a similar length;
+    rows are returned in the original order.
+    """
+    device = next(model.parameters()).device
+    model.eval()
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    probs = np.zeros((len(texts), model.config.num_labels))
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encoded = tokenizer(
+                [texts[i] for i in batch],
+                truncation=True,
+                padding=True,
+                return_tensors='pt'
+            ).to(device)
+            probs[batch] = torch.softmax(model(**encoded).logits, dim=-1).cpu().numpy()
+    return probs
+
+def torch_predict_proba(model_dir, texts, batch_size=32):
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = BertForSequenceClassification.from_pretrained(model_dir)
+    return predict_proba_batched(model, tokenizer, texts, batch_size)
+
+def parity_check(model_dir, onnx_dir, backend, data_path, batch_size=32, show=10):
+    """Compare an ONNX backend against the torch model and report the largest probability gap."""
+    import pandas as pd
+
+    df = pd.read_csv(data_path, encoding='ISO-8859-1')
+    texts = df['text'].astype(str).str.strip().tolist()
+
+    reference = torch_predict_proba(model_dir, texts, batch_size)
+    candidate = load_bert_classifier(backend, model_dir, onnx_dir).predict_proba(texts, batch_size)
+
+    diff = np.abs(reference - candidate)
+    ref_labels = reference.argmax(axis=1)
+    cand_labels = candidate.argmax(axis=1)
+    disagreements = np.flatnonzero(ref_labels != cand_labels)
+
+    print(f"Parity check: torch-fp32 vs {backend} on {len(texts)} samples from {data_path}")
+    print(f"  Max abs probability difference: {diff.max():.6f}")
+    print(f"  Mean abs probability difference: {diff.mean():.6f}")
+    print(f"  Label disagreements: {len(disagreements)} ({len(disagreements) / len(texts):.2%})")
+    for i in disagreements[:show]:
+        print(f"    '{texts[i]}': torch={ref_labels[i]} ({reference[i].max():.3f}) "
+              f"{backend}={cand_labels[i]} ({candidate[i].max():.3f})")
+    return {
+        'max_abs_diff': float(diff.max()),
+        'label_disagreements': int(len(disagreements)),
+        'samples': len(texts)
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export or validate ONNX inference backends for the BERT classifier")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Export ./models/bert_model to ONNX fp32 and int8")
+    export_parser.add_argument('--model-dir', default='./models/bert_model')
+    export_parser.add_argument('--onnx-dir', default='./models/bert_onnx')
+
+    parity_parser = subparsers.add_parser('parity', help="Compare an ONNX backend against the torch model")
+    parity_parser.add_argument('--model-dir', default='./models/bert_model')
+    parity_parser.add_argument('--onnx-dir', default='./models/bert_onnx')
+    parity_parser.add_argument('--backend', choices=BACKENDS[1:], default='onnx-int8')
+    parity_parser.add_argument('--data', default='balanced_data.csv')
+    parity_parser.add_argument('--batch-size', type=int, default=32)
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        onnx_path = export_onnx(args.model_dir, args.onnx_dir)
+        quantize_onnx(onnx_path, os.path.join(args.onnx_dir, ONNX_INT8_FILE))
+    else:
+        parity_check(args.model_dir, args.onnx_dir, args.backend, args.data, args.batch_size)
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import copy
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import BertForSequenceClassification, pipeline
+
+from bert_backends import predict_proba_batched
+
+def make_student(teacher, num_layers=2):
+    """A shallow copy of the teacher: same embeddings and tokenizer, only its first ``num_layers`` encoder layers."""
+    config = copy.deepcopy(teacher.config)
+    config.num_hidden_layers = num_layers
+    student = BertForSequenceClassification(config)
+    teacher_state = teacher.state_dict()
+    student_state = student.state_dict()
+    student.load_state_dict({key: teacher_state[key] for key in student_state if key in teacher_state})
+    return student
+
+def distill_student(teacher, tokenizer, texts, labels, num_layers=2, epochs=4, batch_size=32,
+                    learning_rate=5e-5, temperature=2.0, alpha=0.7, max_length=64, seed=42):
+    """Train a few-layer student on the teacher's softened probabilities plus the true labels.
+
+    The loss is ``alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * CE(student, labels)``.
+    """
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    device = next(teacher.parameters()).device
+
+    # Log-probabilities work as teacher logits: softmax is unchanged by the per-row shift
+    teacher_probs = predict_proba_batched(teacher, tokenizer, texts, batch_size)
+    teacher_logits = torch.tensor(np.log(np.clip(teacher_probs, 1e-12, 1.0)), dtype=torch.float)
+    targets = torch.tensor(labels, dtype=torch.long)
+
+    student = make_student(teacher, num_layers).to(device)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=learning_rate, weight_decay=0.01)
+
+    for epoch in range(epochs):
+        student.train()
+        epoch_start = time.perf_counter()
+        total_loss = 0.0
+        order = rng.permutation(len(texts))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encoded = tokenizer(
+                [texts[i] for i in batch],
+                truncation=True,
+                max_length=max_length,
+                padding=True,
+                return_tensors='pt'
+            ).to(device)
+            logits = student(**encoded).logits
+            soft_targets = F.softmax(teacher_logits[batch].to(device) / temperature, dim=-1)
+            kd_loss = F.kl_div(F.log_softmax(logits / temperature, dim=-1), soft_targets, reduction='batchmean')
+            ce_loss = F.cross_entropy(logits, targets[batch].to(device))
+            loss = alpha * temperature ** 2 * kd_loss + (1 - alpha) * ce_loss
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(batch)
+        print(f"Distillation epoch {epoch + 1}/{epochs}: loss {total_loss / len(texts):.4f} "
+              f"({time.perf_counter() - epoch_start:.1f}s)")
+
+    student.eval()
+    return student
+
+def _dir_size_mb(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    ) / (1024 * 1024)
+
+def _profile_model(model_dir, texts, labels, latency_samples=200):
+    start = time.perf_counter()
+    classifier = pipeline("text-classification", model=model_dir, tokenizer=model_dir, truncation=True)
+    load_seconds = time.perf_counter() - start
+
+    probs = predict_proba_batched(classifier.model, classifier.tokenizer, texts)
+    accuracy = float((probs.argmax(axis=1) == np.asarray(labels)).mean())
+
+    sample = texts[:latency_samples]
+    classifier(sample[0])  # warm-up
+    start = time.perf_counter()
+    for text in sample:
+        classifier(text)
+    latency_ms = (time.perf_counter() - start) * 1000.0 / max(len(sample), 1)
+
+    return {
+        'accuracy': accuracy,
+        'parameters': int(sum(p.numel() for p in classifier.model.parameters())),
+        'size_mb': _dir_size_mb(model_dir),
+        'load_seconds': load_seconds,
+        'latency_ms_per_query': latency_ms,
+        'probs': probs
+    }
+
+def distillation_report(teacher_dir, student_dir, texts, labels, output_path=None):
+    """Compare teacher and student on held-out texts: accuracy, size, load time and single-query latency."""
+    teacher = _profile_model(teacher_dir, texts, labels)
+    student = _profile_model(student_dir, texts, labels)
+    agreement = float((teacher.pop('probs').argmax(axis=1) == student.pop('probs').argmax(axis=1)).mean())
+    report = {'teacher': teacher, 'student': student, 'label_agreement': agreement, 'samples': len(texts)}
+
+    print(f"\nDistillation report ({len(texts)} held-out samples):")
+    print(f"  {'':<22} {'teacher':>12} {'student':>12}")
+    for key, fmt in (('accuracy', '.4f'), ('parameters', ',d'), ('size_mb', '.1f'),
+                     ('load_seconds', '.2f'), ('latency_ms_per_query', '.2f')):
+        print(f"  {key:<22} {teacher[key]:>12{fmt}} {student[key]:>12{fmt}}")
+    print(f"  Teacher/student label agreement: {agreement:.2%}")
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
@@ -0,0 +1,73 @@
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+def run_batched(service, texts, batch_size, **kwargs):
+    """run_pipeline over ``texts`` in batches of ``batch_size``, so memory stays flat however large the CSV is."""
+    results = []
+    for start in range(0, len(texts), batch_size):
+        results.extend(service.run_pipeline(texts[start:start + batch_size], **kwargs))
+    return results
+
+def evaluate(data_path, thresholds, batch_size=256):
+    """Compare the cascade against the full BERT + forest pipeline on a labelled CSV."""
+    import app as service
+    models = service.ensure_loaded()
+
+    df = pd.read_csv(data_path, encoding='ISO-8859-1')
+    texts = df['text'].astype(str).str.strip().tolist()
+    label_ids = {name: idx for idx, name in service.risk_map.items()}
+    labels = np.array([label_ids.get(label, -1) for label in df['label'].astype(str).str.strip()])
+
+    start = time.perf_counter()
+    full = np.array([r['predictedLabel'] for r in run_batched(service, texts, batch_size, cascade=False, model_set=models)])
+    full_seconds = time.perf_counter() - start
+    report = {
+        'data': data_path,
+        'samples': len(texts),
+        'model_version': models.version,
+        'linear_model': models.linear_model is not None,
+        'full': {'accuracy': float((full == labels).mean()), 'seconds': full_seconds},
+        'cascade': []
+    }
+
+    for threshold in thresholds:
+        start = time.perf_counter()
+        results = run_batched(service, texts, batch_size, cascade=True, linear_threshold=threshold, model_set=models)
+        seconds = time.perf_counter() - start
+        predicted = np.array([r['predictedLabel'] for r in results])
+        tiers = pd.Series([r['decidedBy'] for r in results]).value_counts().to_dict()
+        report['cascade'].append({
+            'threshold': threshold,
+            'accuracy': float((predicted == labels).mean()),
+            'accuracy_cost': float((full == labels).mean() - (predicted == labels).mean()),
+            'agreement_with_full': float((predicted == full).mean()),
+            'bert_calls_avoided': 1.0 - tiers.get('bert', 0) / len(texts),
+            'tiers': {tier: int(count) for tier, count in tiers.items()},
+            'seconds': seconds
+        })
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline accuracy / BERT-savings evaluation of the prediction cascade")
+    parser.add_argument('--data', default='balanced_data.csv')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.6, 0.7, 0.8, 0.9, 0.95])
+    parser.add_argument('--output', help="Write the report as JSON to this file")
+    parser.add_argument('--batch-size', type=int, default=256, help="Queries per pipeline batch")
+    args = parser.parse_args()
+
+    report = evaluate(args.data, args.thresholds, args.batch_size)
+    print(f"Full pipeline accuracy on {report['samples']} samples: {report['full']['accuracy']:.4f} "
+          f"({report['full']['seconds']:.1f}s)")
+    if not report['linear_model']:
+        print("No linear pre-model found; only the rules tier can skip BERT")
+    print(f"{'threshold':>9} {'accuracy':>9} {'cost':>8} {'agree':>7} {'BERT avoided':>13} {'time':>7}  tiers")
+    for row in report['cascade']:
+        print(f"{row['threshold']:>9.2f} {row['accuracy']:>9.4f} {row['accuracy_cost']:>+8.4f} "
+              f"{row['agreement_with_full']:>7.2%} {row['bert_calls_avoided']:>13.1%} {row['seconds']:>6.1f}s  {row['tiers']}")
+    print("Note: balanced_data.csv is also the training set, so absolute accuracies are optimistic.")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,37 @@
+import numpy as np
+from scipy import sparse
+
+def build_feature_matrix(X_text, sentiment_scaled, bert_probs):
+    """Stack [TF-IDF | scaled sentiment | BERT probabilities] into one CSR matrix.
+
+    train.py and app.py both go through this function so the column layout the
+    forest was fitted on is exactly the one it is served with.
+    """
+    sentiment_scaled = np.asarray(sentiment_scaled, dtype=np.float64).reshape(-1, 1)
+    bert_probs = np.asarray(bert_probs, dtype=np.float64).reshape(sentiment_scaled.shape[0], -1)
+    return sparse.hstack([
+        sparse.csr_matrix(X_text, dtype=np.float64),
+        sparse.csr_matrix(sentiment_scaled),
+        sparse.csr_matrix(bert_probs)
+    ], format='csr')
+
+def build_linear_features(X_text, sentiment_scaled):
+    """[TF-IDF | scaled sentiment] input of the cascade's linear pre-model (no BERT columns)."""
+    sentiment_scaled = np.asarray(sentiment_scaled, dtype=np.float64).reshape(-1, 1)
+    return sparse.hstack([
+        sparse.csr_matrix(X_text, dtype=np.float64),
+        sparse.csr_matrix(sentiment_scaled)
+    ], format='csr')
+
+def top1_probs(probs):
+    """Keep only the winning class score in each row and zero the rest.
+
+    This is what the text-classification pipeline returns by default, and it is
+    the form of the BERT columns the forest is trained and served on.
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    top1 = np.zeros_like(probs)
+    rows = np.arange(probs.shape[0])
+    winners = probs.argmax(axis=1)
+    top1[rows, winners] = probs[rows, winners]
+    return top1
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import joblib
+
+BUNDLE_FORMAT = 1
+MANIFEST_FILE = 'manifest.json'
+CURRENT_FILE = 'CURRENT'
+SKLEARN_FILE = 'sklearn.joblib'
+BERT_DIR = 'bert'
+ONNX_DIR = 'onnx'
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _write_bert(source_dir, target_dir):
+    from transformers import AutoTokenizer, BertForSequenceClassification
+
+    # Re-saving guarantees safetensors weights, which from_pretrained memory-maps instead of unpickling
+    BertForSequenceClassification.from_pretrained(source_dir).save_pretrained(target_dir, safe_serialization=True)
+    AutoTokenizer.from_pretrained(source_dir).save_pretrained(target_dir)
+
+def prune_bundles(root, keep=3):
+    """Delete all but the ``keep`` most recently written bundles under ``root``; CURRENT's is always kept.
+
+    Servers still mapping a deleted bundle's files keep reading them until
+    they reload, since the data is only freed once the last mapping goes away.
+    """
+    current = resolve_bundle(root)
+    bundles = [
+        os.path.join(root, name) for name in os.listdir(root)
+        if not name.startswith('.') and os.path.exists(os.path.join(root, name, MANIFEST_FILE))
+    ]
+    bundles.sort(key=os.path.getmtime, reverse=True)
+    removed = []
+    for bundle_dir in bundles[max(keep, 0):]:
+        if current is not None and os.path.samefile(bundle_dir, current):
+            continue
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        removed.append(bundle_dir)
+    return removed
+
+def write_bundle(root, components, bert_dir, onnx_dir=None, keep=3):
+    """Pack the sklearn components and BERT into ``root/<version>`` and point ``root/CURRENT`` at it.
+
+    ``components`` maps names (vectorizer, scaler, rf_model, linear_model) to
+    fitted objects. They go into one uncompressed joblib file so their numpy
+    arrays can be memory-mapped at load time. The version is a hash of every
+    file in the bundle, so retraining to identical artifacts reuses the version.
+    Once CURRENT is switched, only the ``keep`` newest bundles are kept.
+    """
+    os.makedirs(root, exist_ok=True)
+    staging = os.path.join(root, f'.staging-{os.getpid()}')
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    joblib.dump({name: value for name, value in components.items() if value is not None},
+                os.path.join(staging, SKLEARN_FILE))
+    _write_bert(bert_dir, os.path.join(staging, BERT_DIR))
+    has_onnx = bool(onnx_dir) and os.path.isdir(onnx_dir) and any(name.endswith('.onnx') for name in os.listdir(onnx_dir))
+    if has_onnx:
+        shutil.copytree(onnx_dir, os.path.join(staging, ONNX_DIR))
+
+    files = {}
+    for directory, _, names in os.walk(staging):
+        for name in names:
+            path = os.path.join(directory, name)
+            files[os.path.relpath(path, staging).replace(os.sep, '/')] = {
+                'sha256': _file_digest(path),
+                'bytes': os.path.getsize(path)
+            }
+    version = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()[:12]
+
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'version': version,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'components': sorted(name for name, value in components.items() if value is not None),
+        'bert': BERT_DIR,
+        'onnx': ONNX_DIR if has_onnx else None,
+        'files': files
+    }
+    with open(os.path.join(staging, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    bundle_dir = os.path.join(root, version)
+    if os.path.exists(bundle_dir):
+        shutil.rmtree(staging)
+        os.utime(bundle_dir)  # counts as the newest bundle when pruning
+    else:
+        os.replace(staging, bundle_dir)
+
+    current_tmp = os.path.join(root, CURRENT_FILE + '.tmp')
+    with open(current_tmp, 'w') as f:
+        f.write(version + '\n')
+    os.replace(current_tmp, os.path.join(root, CURRENT_FILE))
+    for removed in prune_bundles(root, keep):
+        print(f"Removed old model bundle {removed}")
+    return bundle_dir
+
+def resolve_bundle(path):
+    """The bundle directory for ``path`` (a bundle itself or a root with CURRENT), or None."""
+    if not path:
+        return None
+    if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        return path
+    current = os.path.join(path, CURRENT_FILE)
+    if os.path.exists(current):
+        with open(current) as f:
+            bundle_dir = os.path.join(path, f.read().strip())
+        if os.path.exists(os.path.join(bundle_dir, MANIFEST_FILE)):
+            return bundle_dir
+    return None
+
+def load_bundle(bundle_dir):
+    """Read the manifest and memory-map the sklearn components; BERT is left to the caller.
+
+    Only file sizes are checked against the manifest: hashing every file would
+    read the whole bundle and defeat the lazy mapping.
+    """
+    with open(os.path.join(bundle_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise ValueError(f"Unsupported bundle format {manifest.get('format')} in {bundle_dir}, expected {BUNDLE_FORMAT}")
+    for name, info in manifest['files'].items():
+        path = os.path.join(bundle_dir, name)
+        if not os.path.exists(path) or os.path.getsize(path) != info['bytes']:
+            raise ValueError(f"Bundle {bundle_dir} is incomplete or modified: {name}")
+    components = joblib.load(os.path.join(bundle_dir, SKLEARN_FILE), mmap_mode='r')
+    return manifest, components
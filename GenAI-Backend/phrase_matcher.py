@@ -0,0 +1,111 @@
+import json
+from collections import deque, namedtuple
+
+RISK_CATEGORIES = ('suicide', 'depression', 'isolation', 'anxiety')
+
+MatchResult = namedtuple('MatchResult', [
+    'categories',           # lexicon categories with at least one substring hit
+    'negated',              # a risk word is preceded by a negation within 3 words
+    'has_negation',         # any negation word appears in the query
+    'common_object_hated'   # "hate <common object>" / "hate when|that|how|what"
+])
+
+def load_lexicons(path):
+    with open(path, encoding='utf-8') as f:
+        raw = json.load(f)
+    return {name: {phrase.lower() for phrase in phrases} for name, phrases in raw.items()}
+
+class AhoCorasick:
+    """Multi-pattern substring matcher compiled into a flat DFA.
+
+    ``search`` walks the text once and returns the tags of every pattern that
+    occurs anywhere in it, including overlapping occurrences, which is what
+    ``any(phrase in text for phrase in phrases)`` computes per tag.
+    """
+
+    def __init__(self, patterns):
+        goto = [{}]
+        outputs = [set()]
+        for phrase, tag in patterns:
+            node = 0
+            for ch in phrase:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    outputs.append(set())
+                node = nxt
+            outputs[node].add(tag)
+
+        # Breadth-first pass to resolve failure links into full transitions
+        delta = [dict(edges) for edges in goto]
+        fail = [0] * len(goto)
+        pending = deque(goto[0].values())
+        while pending:
+            node = pending.popleft()
+            outputs[node] |= outputs[fail[node]]
+            for ch, target in delta[fail[node]].items():
+                delta[node].setdefault(ch, target)
+            for ch, child in goto[node].items():
+                fail[child] = delta[fail[node]].get(ch, 0)
+                pending.append(child)
+
+        self._delta = delta
+        self._outputs = [frozenset(out) for out in outputs]
+
+    def search(self, text):
+        delta = self._delta
+        outputs = self._outputs
+        state = 0
+        hits = set()
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                hits |= outputs[state]
+        return hits
+
+class PhraseMatcher:
+    """Risk lexicons compiled once and matched against a query in a single pass."""
+
+    def __init__(self, lexicons):
+        self.lexicons = lexicons
+        self._automaton = AhoCorasick(
+            (phrase, name)
+            for name in (*RISK_CATEGORIES, 'no_risk', 'common_objects')
+            for phrase in lexicons.get(name, ())
+        )
+        self._objects = AhoCorasick((phrase, 'common_objects') for phrase in lexicons.get('common_objects', ()))
+        self._risk_words = set().union(*(lexicons.get(name, set()) for name in RISK_CATEGORIES))
+        self._negations = lexicons.get('negation', set())
+        self._hate_clause_words = lexicons.get('hate_clause_words', set())
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_lexicons(path))
+
+    def match(self, text):
+        categories = self._automaton.search(text)
+
+        words = text.split()
+        negated = False
+        has_negation = False
+        last_negation = -4
+        hate_index = None
+        for i, word in enumerate(words):
+            if word in self._risk_words and i - last_negation <= 3:
+                negated = True
+            if word in self._negations:
+                has_negation = True
+                last_negation = i
+            if hate_index is None and word == 'hate':
+                hate_index = i
+
+        common_object_hated = False
+        if hate_index is not None:
+            next_words = words[hate_index + 1:hate_index + 3]
+            if next_words and (next_words[0] in self._hate_clause_words or
+                               self._objects.search(' '.join(next_words))):
+                common_object_hated = True
+
+        return MatchResult(frozenset(categories), negated, has_negation, common_object_hated)
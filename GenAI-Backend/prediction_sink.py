@@ -0,0 +1,201 @@
+import os
+import copy
+import time
+import queue
+import threading
+from datetime import datetime, timezone
+
+try:
+    from pymongo.errors import BulkWriteError
+except ImportError:
+    BulkWriteError = None
+
+# predictedResult values the Node backends treat as not harmful
+NOT_HARMFUL = ('no risk', 'unknown', 'safe', 'neutral')
+
+def _parse_time(value, default):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+    return default
+
+def search_document(response, metadata=None):
+    """A SearchHistory-shaped document (the Node `searches` schema) for one /predict response.
+
+    ``metadata`` is the optional object clients send alongside the query
+    (childName, userEmail, timestamp). Model details are kept as extra fields.
+    """
+    metadata = metadata if isinstance(metadata, dict) else {}
+    now = datetime.now(timezone.utc)
+    predicted_result = str(response['predictedRisk']).lower().replace('_', ' ').strip()
+    document = {
+        'userId': str(response['userId']),
+        'userEmail': metadata.get('userEmail'),
+        'childName': metadata.get('childName'),
+        'query': response['query'],
+        'dateAndTime': _parse_time(metadata.get('timestamp'), now),
+        'isHarmful': predicted_result not in NOT_HARMFUL,
+        'predictedResult': predicted_result,
+        'sentimentScore': response['sentimentScore'],
+        'totalTimeSpent': 0,
+        'timestamp': now,
+        'predictedLabel': response['predictedLabel'],
+        'confidence': response['confidence'],
+        'decidedBy': response['decidedBy'],
+        'modelVersion': response['modelVersion']
+    }
+    return {key: value for key, value in document.items() if value is not None}
+
+class InMemoryCollection:
+    """Stand-in for a pymongo collection with the insert_many surface the sink uses.
+
+    ``fail_next`` makes that many upcoming insert_many calls raise, to exercise retries.
+    """
+
+    def __init__(self, fail_next=0):
+        self.documents = []
+        self.fail_next = fail_next
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def insert_many(self, documents, ordered=True):
+        with self._lock:
+            self.calls += 1
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise ConnectionError("simulated write failure")
+            self.documents.extend(copy.deepcopy(documents))
+            return len(documents)
+
+    def count_documents(self, filter=None):
+        filter = filter or {}
+        with self._lock:
+            return sum(all(doc.get(key) == value for key, value in filter.items()) for doc in self.documents)
+
+def mongo_collection_factory(uri, collection_name, database_name=None):
+    """Deferred collection opener; ``memory://`` gives an InMemoryCollection.
+
+    The client is created on the sink's worker thread, after any fork, because
+    MongoClient instances must not be shared across fork.
+    """
+    def connect():
+        if uri.startswith('memory://'):
+            return InMemoryCollection()
+        from pymongo import MongoClient
+        client = MongoClient(uri, w=1)
+        database = client[database_name] if database_name else client.get_default_database(default='genai')
+        return database[collection_name]
+    return connect
+
+class PredictionSink:
+    """Write-behind buffer that persists prediction documents with batched insert_many calls.
+
+    submit() never blocks: when the bounded buffer is full the document is
+    dropped and counted. A background thread writes a batch once it holds
+    ``batch_size`` documents or its oldest document has waited
+    ``flush_interval`` seconds, retrying failed writes with exponential backoff.
+    The worker is started lazily (and again after a fork), like MicroBatcher.
+    """
+
+    def __init__(self, connect, max_buffer=10_000, batch_size=500, flush_interval=1.0,
+                 max_retries=5, retry_backoff=0.5):
+        self.connect = connect
+        self.max_buffer = max(1, int(max_buffer))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_interval))
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.collection = None
+        self._queue = None
+        self._worker_pid = None
+        self._lock = threading.Lock()
+        self._counts = {'enqueued': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'retries': 0, 'batches': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._worker_pid == pid:
+            return self._queue
+        with self._lock:
+            if self._worker_pid != pid:
+                self._queue = queue.Queue(maxsize=self.max_buffer)
+                self.collection = None
+                worker = threading.Thread(target=self._run, args=(self._queue,), daemon=True)
+                worker.start()
+                self._worker_pid = pid
+        return self._queue
+
+    def submit(self, document):
+        try:
+            self._ensure_worker().put_nowait(document)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    pending.task_done()
+
+    def _write(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.collection is None:
+                    self.collection = self.connect()
+                # pymongo assigns each document's _id before sending, so a retry after a
+                # partially applied batch reports the already-stored ones as duplicates
+                self.collection.insert_many(batch, ordered=False)
+                self._count('written', len(batch))
+                self._count('batches')
+                return
+            except Exception as e:
+                if BulkWriteError is not None and isinstance(e, BulkWriteError):
+                    errors = e.details.get('writeErrors', [])
+                    if all(error.get('code') == 11000 for error in errors):
+                        self._count('written', len(batch) - len(errors) if attempt == 0 else len(batch))
+                        self._count('batches')
+                        return
+                if attempt == self.max_retries:
+                    print(f"Prediction sink dropped {len(batch)} documents after {attempt + 1} attempts: {e}")
+                    self._count('failed', len(batch))
+                    return
+                self._count('retries')
+                time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far is written or given up on; returns False on timeout."""
+        pending = self._queue
+        if pending is None or self._worker_pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while pending.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        stats['buffered'] = self._queue.qsize() if self._queue is not None else 0
+        return stats
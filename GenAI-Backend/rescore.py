@@ -0,0 +1,230 @@
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import argparse
+import collections
+import multiprocessing
+
+CHECKPOINT_SUFFIX = '.checkpoint.json'
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score historical queries offline with the same pipeline as /predict")
+    parser.add_argument('--input', required=True, help="CSV or JSONL file of queries")
+    parser.add_argument('--output', required=True,
+                        help="Results as JSONL (*.jsonl) or a directory of Parquet parts (*.parquet)")
+    parser.add_argument('--query-field', help="Column/key holding the query text (default: query, else text)")
+    parser.add_argument('--keep-fields', nargs='*', default=[],
+                        help="Input fields copied to every output record, e.g. _id dateAndTime")
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Scoring processes (<= 1 scores in this process)")
+    parser.add_argument('--threads-per-worker', type=int, default=0,
+                        help="torch intra-op threads per worker (default: CPU count / workers)")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="Rows per task; also the checkpoint granularity")
+    parser.add_argument('--batch-size', type=int, default=64, help="Queries per pipeline (and BERT) batch")
+    parser.add_argument('--resume', action='store_true', help="Continue from the output's checkpoint")
+    args = parser.parse_args(argv)
+    if args.threads_per_worker <= 0:
+        args.threads_per_worker = max(1, (os.cpu_count() or 1) // max(1, args.workers))
+    return args
+
+def _format(path):
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def read_chunks(path, chunk_size, encoding='utf-8'):
+    """Yield lists of input records (dicts) of up to ``chunk_size`` rows without reading the whole file."""
+    if _format(path) == 'jsonl':
+        chunk = []
+        with open(path, encoding=encoding) as f:
+            for line in f:
+                if line.strip():
+                    chunk.append(json.loads(line))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+    else:
+        import pandas as pd
+        for frame in pd.read_csv(path, chunksize=chunk_size, encoding=encoding, dtype=str, keep_default_na=False):
+            yield frame.to_dict('records')
+
+class JsonlWriter:
+    def __init__(self, path, resume_bytes=0):
+        self.path = path
+        self._file = open(path, 'r+b' if resume_bytes else 'wb')
+        # Drop anything written after the last checkpoint
+        self._file.truncate(resume_bytes)
+        self._file.seek(resume_bytes)
+
+    def write(self, records):
+        self._file.write(''.join(json.dumps(record) + '\n' for record in records).encode('utf-8'))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+class ParquetWriter:
+    """One Parquet part file per chunk, so every checkpointed chunk is a complete, readable file."""
+
+    def __init__(self, path, resume_parts=0):
+        import pyarrow  # noqa: F401  fail before any scoring if Parquet output isn't available
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.startswith('part-') and int(name[5:10]) >= resume_parts:
+                os.remove(os.path.join(path, name))
+        self.parts = resume_parts
+
+    def write(self, records):
+        import pandas as pd
+        part = os.path.join(self.path, f'part-{self.parts:05d}.parquet')
+        pd.DataFrame.from_records(records).to_parquet(part + '.tmp', index=False, engine='pyarrow')
+        os.replace(part + '.tmp', part)
+        self.parts += 1
+        return self.parts
+
+    def close(self):
+        pass
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(path, state):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+# Set in each scoring process by _init_worker
+_service = None
+_options = None
+
+def _init_worker(options, threads):
+    global _service, _options
+    import torch
+    import app
+
+    torch.set_num_threads(threads)
+    app.ensure_loaded()  # already loaded when the pool forked from the parent; loads here under spawn
+    app.warm_up()
+    _service, _options = app, options
+
+def _score_chunk(rows):
+    """Score one chunk of input records in pipeline batches and build the output records."""
+    query_field, keep_fields, batch_size = _options
+    queries = [str(row.get(query_field) or '').strip() for row in rows]
+    results = []
+    for start in range(0, len(queries), batch_size):
+        results.extend(_service.score_queries(queries[start:start + batch_size]))
+
+    records = []
+    for row, query, result in zip(rows, queries, results):
+        record = {field: row.get(field) for field in keep_fields}
+        record.update(_service.build_response(row.get('userId', ''), query, result))
+        records.append(record)
+    return records
+
+def _detect_query_field(path, encoding):
+    first = next(read_chunks(path, 1, encoding), [{}])[0]
+    for name in ('query', 'text'):
+        if name in first:
+            return name
+    sys.exit(f"No 'query' or 'text' field in {path}; pass --query-field")
+
+def rescore(args):
+    query_field = args.query_field or _detect_query_field(args.input, args.encoding)
+    parquet = args.output.lower().endswith('.parquet')
+    checkpoint_path = args.output.rstrip('/\\') + CHECKPOINT_SUFFIX
+
+    # Thread pools must be sized before torch initialises them in this process
+    os.environ.setdefault('OMP_NUM_THREADS', str(args.threads_per_worker))
+    os.environ.setdefault('MKL_NUM_THREADS', str(args.threads_per_worker))
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
+    import app
+    # Loaded once here so forked workers share the mapped model pages
+    model_version = app.load_models(warm=False).version
+
+    state = {
+        'input': os.path.abspath(args.input),
+        'query_field': query_field,
+        'chunk_size': args.chunk_size,
+        'model_version': model_version,
+        'chunks_done': 0,
+        'rows_done': 0,
+        'output_position': 0
+    }
+    if args.resume:
+        previous = load_checkpoint(checkpoint_path)
+        if previous is None:
+            print(f"No checkpoint at {checkpoint_path}, starting from the beginning")
+        else:
+            for key in ('input', 'query_field', 'chunk_size', 'model_version'):
+                if previous[key] != state[key]:
+                    sys.exit(f"Cannot resume: {key} was {previous[key]!r}, now {state[key]!r}")
+            state = previous
+            print(f"Resuming after {state['rows_done']} rows ({state['chunks_done']} chunks)")
+    elif os.path.exists(args.output):
+        if parquet and os.path.isdir(args.output):
+            shutil.rmtree(args.output)
+        else:
+            os.remove(args.output)
+
+    writer = ParquetWriter(args.output, state['output_position']) if parquet else JsonlWriter(args.output, state['output_position'])
+    options = (query_field, args.keep_fields, args.batch_size)
+    chunks = read_chunks(args.input, args.chunk_size, args.encoding)
+    for _ in range(state['chunks_done']):
+        next(chunks, None)
+
+    start = time.perf_counter()
+    rows_this_run = 0
+
+    def commit(records):
+        nonlocal rows_this_run
+        state['output_position'] = writer.write(records)
+        state['chunks_done'] += 1
+        state['rows_done'] += len(records)
+        save_checkpoint(checkpoint_path, state)
+        rows_this_run += len(records)
+        elapsed = time.perf_counter() - start
+        print(f"\r{state['rows_done']:,} rows scored | {rows_this_run / max(elapsed, 1e-9):,.0f} rows/s | "
+              f"{elapsed:,.0f}s elapsed", end='', file=sys.stderr, flush=True)
+
+    try:
+        if args.workers <= 1:
+            _init_worker(options, args.threads_per_worker)
+            for rows in chunks:
+                commit(_score_chunk(rows))
+        else:
+            gc.collect()
+            gc.freeze()
+            method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+            context = multiprocessing.get_context(method)
+            with context.Pool(args.workers, _init_worker, (options, args.threads_per_worker)) as pool:
+                # Bounded window of chunks in flight: reads stay streaming and results are written in input order
+                pending = collections.deque()
+                for rows in chunks:
+                    pending.append(pool.apply_async(_score_chunk, (rows,)))
+                    if len(pending) >= args.workers * 2:
+                        commit(pending.popleft().get())
+                while pending:
+                    commit(pending.popleft().get())
+    finally:
+        writer.close()
+        print(file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {rows_this_run:,} rows in {elapsed:.1f}s ({rows_this_run / max(elapsed, 1e-9):,.0f} rows/s) "
+          f"with model {model_version}; {state['rows_done']:,} rows in {args.output}")
+    return state
+
+if __name__ == '__main__':
+    rescore(parse_args())
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import tempfile
+import itertools
+import numpy as np
+import joblib
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold
+
+DEFAULT_GRID = {
+    'n_estimators': [25, 50, 100, 200],
+    'max_depth': [8, 10, 16, None],
+    'min_samples_leaf': [1, 2],
+    'max_features': ['sqrt']
+}
+
+def expand_grid(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def _time_predict_proba(model, X, samples):
+    """Mean seconds per single-row predict_proba call, which is how the API scores a query."""
+    rows = min(samples, X.shape[0])
+    model.predict_proba(X[:1])  # warm-up
+    start = time.perf_counter()
+    for i in range(rows):
+        model.predict_proba(X[i:i + 1])
+    return (time.perf_counter() - start) / max(rows, 1)
+
+def _run_fold(params, X, y, train_index, test_index, seed, model_path=None):
+    # One core per fit: the search parallelises across (config, fold) pairs, and
+    # serving scores one query at a time, so single-threaded latency is what matters
+    model = RandomForestClassifier(n_jobs=1, random_state=seed, **params)
+    start = time.perf_counter()
+    model.fit(X[train_index], y[train_index])
+    fit_seconds = time.perf_counter() - start
+    accuracy = float((model.predict(X[test_index]) == y[test_index]).mean())
+    if model_path is not None:
+        joblib.dump(model, model_path)
+    return {'accuracy': accuracy, 'fit_seconds': fit_seconds}
+
+def search(X, y, grid=None, folds=5, n_jobs=-1, latency_samples=200, seed=42):
+    """Stratified k-fold accuracy and per-sample predict_proba latency for every config in ``grid``.
+
+    The CV fits run in parallel; latency is timed afterwards, one config at a
+    time, on each config's first-fold model so the timings aren't skewed by fits
+    competing for the same cores.
+    """
+    configs = expand_grid(grid or DEFAULT_GRID)
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(np.zeros(len(y)), y))
+    with tempfile.TemporaryDirectory(prefix='rf_search-') as model_dir:
+        model_paths = [os.path.join(model_dir, f'config-{i}.joblib') for i in range(len(configs))]
+        fold_results = Parallel(n_jobs=n_jobs)(
+            delayed(_run_fold)(params, X, y, train_index, test_index, seed, model_path if fold == 0 else None)
+            for params, model_path in zip(configs, model_paths)
+            for fold, (train_index, test_index) in enumerate(splits)
+        )
+
+        latencies = []
+        X_test = X[splits[0][1]]
+        for model_path in model_paths:
+            latencies.append(_time_predict_proba(joblib.load(model_path), X_test, latency_samples) * 1000.0)
+            os.remove(model_path)
+
+    results = []
+    for i, params in enumerate(configs):
+        per_fold = fold_results[i * folds:(i + 1) * folds]
+        accuracies = [fold['accuracy'] for fold in per_fold]
+        results.append({
+            'params': params,
+            'accuracy_mean': float(np.mean(accuracies)),
+            'accuracy_std': float(np.std(accuracies)),
+            'latency_ms': latencies[i],
+            'fit_seconds': float(np.mean([fold['fit_seconds'] for fold in per_fold]))
+        })
+    return results
+
+def pareto_front(results):
+    """Configs no other config beats on both accuracy and latency, fastest first."""
+    front = [
+        r for r in results
+        if not any(
+            o['accuracy_mean'] >= r['accuracy_mean'] and o['latency_ms'] <= r['latency_ms']
+            and (o['accuracy_mean'] > r['accuracy_mean'] or o['latency_ms'] < r['latency_ms'])
+            for o in results
+        )
+    ]
+    return sorted(front, key=lambda r: r['latency_ms'])
+
+def choose_config(results, accuracy_tolerance=0.005):
+    """The fastest Pareto-optimal config whose accuracy is within ``accuracy_tolerance`` of the best."""
+    front = pareto_front(results)
+    best = max(r['accuracy_mean'] for r in front)
+    return next(r for r in front if r['accuracy_mean'] >= best - accuracy_tolerance)
+
+def print_results(results, chosen=None):
+    front = {id(r) for r in pareto_front(results)}
+    print(f"  {'accuracy':>10} {'+/-':>7} {'latency ms':>11} {'fit s':>7}  params")
+    for r in sorted(results, key=lambda r: -r['accuracy_mean']):
+        marker = '*' if r is chosen else ('p' if id(r) in front else ' ')
+        print(f"{marker} {r['accuracy_mean']:>10.4f} {r['accuracy_std']:>7.4f} {r['latency_ms']:>11.3f} "
+              f"{r['fit_seconds']:>7.2f}  {r['params']}")
+    print("  (* chosen, p Pareto-optimal)")
+
+def write_config(path, params, source, search_results=None, chosen=None):
+    config = {'params': params, 'source': source}
+    if search_results is not None:
+        config['cv'] = chosen
+        config['pareto_front'] = pareto_front(search_results)
+        config['results'] = search_results
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=2)
@@ -0,0 +1,170 @@
+import os
+import time
+import signal
+import threading
+import collections
+import multiprocessing
+from multiprocessing.managers import BaseManager
+import numpy as np
+
+DAY = 86400.0
+
+class RiskAggregator:
+    """Per-user, exponentially time-decayed prediction counts and confidences for each risk class.
+
+    Every user costs one fixed-size array of shape (horizons, classes, 2) holding
+    the decayed prediction count and decayed confidence sum per class, plus the
+    time it was last brought up to date. Decay is applied lazily on update and
+    read, so both are O(1) regardless of how much history the user has.
+    """
+
+    def __init__(self, num_classes, half_lives=(DAY, 7 * DAY), max_users=100_000, idle_seconds=30 * DAY):
+        self.num_classes = num_classes
+        self.half_lives = np.asarray(half_lives, dtype=np.float64)
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+        # user id -> [last_update, state]; ordered oldest update first so idle users are evicted from the front
+        self._users = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _decayed(self, entry, now):
+        elapsed = max(now - entry[0], 0.0)
+        return entry[1] * (0.5 ** (elapsed / self.half_lives))[:, None, None]
+
+    def update(self, user_id, label, confidence, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            if entry is None:
+                entry = [now, np.zeros((len(self.half_lives), self.num_classes, 2))]
+            else:
+                entry[1] = self._decayed(entry, now)
+                entry[0] = now
+            entry[1][:, label, 0] += 1.0
+            entry[1][:, label, 1] += confidence
+            self._users[user_id] = entry
+            self._evict(now)
+
+    def _evict(self, now):
+        while self._users:
+            user_id, entry = next(iter(self._users.items()))
+            if len(self._users) <= self.max_users and now - entry[0] <= self.idle_seconds:
+                break
+            del self._users[user_id]
+            self.evictions += 1
+
+    def get(self, user_id, now=None):
+        """Decayed counts and mean confidences per horizon and class, or None for an unknown user."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            last_update = entry[0]
+            state = self._decayed(entry, now)
+        counts = state[:, :, 0]
+        totals = counts.sum(axis=1, keepdims=True)
+        return {
+            'last_update': last_update,
+            'counts': counts,
+            'shares': np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0),
+            'mean_confidence': np.divide(state[:, :, 1], counts, out=np.zeros_like(counts), where=counts > 0)
+        }
+
+    def __len__(self):
+        return len(self._users)
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._users), 'evictions': self.evictions}
+
+    def snapshot(self, path):
+        """Atomically write every user's state to a compressed .npz file."""
+        with self._lock:
+            user_ids = list(self._users)
+            last_updates = np.array([entry[0] for entry in self._users.values()], dtype=np.float64)
+            states = np.array([entry[1] for entry in self._users.values()], dtype=np.float32) \
+                .reshape(len(user_ids), len(self.half_lives), self.num_classes, 2)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Unique per process and thread so concurrent snapshots never share a temp file
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+        np.savez_compressed(
+            tmp_path,
+            user_ids=np.array(user_ids, dtype=str),
+            last_updates=last_updates,
+            states=states,
+            half_lives=self.half_lives
+        )
+        os.replace(tmp_path, path)
+        return len(user_ids)
+
+    def restore(self, path):
+        """Load a snapshot written with the same half-lives and number of classes; returns users restored."""
+        if not os.path.exists(path):
+            return 0
+        with np.load(path) as stored:
+            if not np.array_equal(stored['half_lives'], self.half_lives) or \
+                    stored['states'].shape[2:] != (self.num_classes, 2):
+                print(f"Ignoring risk snapshot {path}: written with a different configuration")
+                return 0
+            order = np.argsort(stored['last_updates'], kind='stable')
+            with self._lock:
+                self._users.clear()
+                for i in order:
+                    self._users[str(stored['user_ids'][i])] = [
+                        float(stored['last_updates'][i]), stored['states'][i].astype(np.float64)
+                    ]
+                self._evict(time.time())
+                return len(self._users)
+
+class AggregatorManager(BaseManager):
+    """Serves one RiskAggregator from its own process, so processes forked later all update the same state."""
+
+_served = None
+
+def _served_aggregator():
+    return _served
+
+AggregatorManager.register('RiskAggregator', callable=_served_aggregator,
+                           exposed=('update', 'get', 'snapshot', 'stats', '__len__'))
+
+def _serve(aggregator, snapshot_path, snapshot_interval, parent):
+    # Runs in the manager process. Terminal and service-manager signals are meant for the parent,
+    # which takes a last snapshot through the manager and then shuts it down.
+    global _served
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_IGN)
+    _served = aggregator
+    threading.Thread(target=_maintain, args=(aggregator, snapshot_path, snapshot_interval, parent), daemon=True).start()
+
+def _maintain(aggregator, snapshot_path, snapshot_interval, parent):
+    next_snapshot = time.monotonic() + snapshot_interval
+    while True:
+        time.sleep(1)
+        orphaned = os.getppid() != parent
+        if snapshot_interval > 0 and (orphaned or time.monotonic() >= next_snapshot):
+            next_snapshot = time.monotonic() + snapshot_interval
+            try:
+                aggregator.snapshot(snapshot_path)
+            except Exception as e:
+                print(f"Risk aggregate snapshot failed: {e}")
+        if orphaned:
+            os._exit(0)
+
+def serve_shared(aggregator, snapshot_path, snapshot_interval):
+    """Start a manager process holding ``aggregator``; connect_shared() to it from processes forked afterwards.
+
+    The manager is forked, so the aggregator (and anything already restored into it)
+    is handed over without pickling. It snapshots every ``snapshot_interval`` seconds
+    (0 disables snapshots) and exits on its own if its parent dies.
+    """
+    manager = AggregatorManager(ctx=multiprocessing.get_context('fork'))
+    manager.start(_serve, (aggregator, snapshot_path, snapshot_interval, os.getpid()))
+    return manager
+
+def connect_shared(address):
+    """A proxy to the shared aggregator with the same update/get/snapshot/stats methods."""
+    manager = AggregatorManager(address=address)
+    manager.connect()
+    return manager.RiskAggregator()
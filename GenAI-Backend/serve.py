@@ -0,0 +1,267 @@
+import os
+import gc
+import sys
+import time
+import select
+import signal
+import socket
+import threading
+import argparse
+import traceback
+
+def parse_args(argv=None):
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Serve the prediction API from preforked workers that share model memory")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--workers', type=int, default=cpu_count, help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--threads-per-worker', type=int, default=0,
+                        help="torch intra-op threads per worker (default: CPU count / workers)")
+    parser.add_argument('--threaded', action='store_true',
+                        help="Handle concurrent requests inside each worker with threads (useful with PREDICT_MICROBATCH=1)")
+    parser.add_argument('--backlog', type=int, default=128)
+    parser.add_argument('--graceful-timeout', type=float, default=30,
+                        help="Seconds a stopping worker gets to finish its requests before it is killed")
+    args = parser.parse_args(argv)
+    args.workers = max(1, args.workers)
+    if args.threads_per_worker <= 0:
+        args.threads_per_worker = max(1, cpu_count // args.workers)
+    return args
+
+def memory_report():
+    """RSS/PSS of this process in MB; PSS splits pages shared with other workers between them."""
+    report = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Dirty'):
+                    report[key] = int(value.split()[0]) / 1024
+    except OSError:
+        import resource
+        report['MaxRss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return ' '.join(f"{key}={value:.0f}MB" for key, value in report.items())
+
+# Handled by the parent; blocked across fork so a new worker can never run the parent's handlers
+PARENT_SIGNALS = {signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGALRM}
+
+def run_worker(sock, args, app_module, slot, ready_fd):
+    import torch
+    from werkzeug.serving import make_server
+
+    # Reloads happen in the parent, which loads the new models once and replaces every worker;
+    # a worker loading them itself would hold a private copy instead of sharing the parent's
+    parent = os.getppid()
+    app_module.worker_reload = lambda: os.kill(parent, signal.SIGHUP)
+    app_module.MODEL_WATCH_INTERVAL = 0
+    # The worker starts with the parent's signals blocked (see spawn). SIGTERM stays blocked in every
+    # thread, torch's pools and request threads included, and is taken by the drain thread below;
+    # a Python handler only runs once the main thread notices, which can take arbitrarily long
+    # when one of torch's threads receives the signal.
+    for signum in PARENT_SIGNALS - {signal.SIGTERM}:
+        signal.signal(signum, signal.SIG_IGN)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, PARENT_SIGNALS - {signal.SIGTERM})
+    torch.set_num_threads(args.threads_per_worker)
+
+    app_module.warm_up()
+    server = make_server(args.host, args.port, app_module.app, threaded=args.threaded, fd=sock.fileno())
+    # socketserver only tracks (and joins on close) request threads that aren't daemons
+    server.daemon_threads = False
+
+    def drain():
+        # serve_forever stops accepting once the request in hand is done and closes the server on
+        # the way out, which joins the --threaded request threads; only then does the worker exit.
+        # A SIGTERM that arrived while warming up is still pending and is taken straight away.
+        signal.sigwait({signal.SIGTERM})
+        server.shutdown()
+
+    threading.Thread(target=drain, daemon=True).start()
+    print(f"Worker {os.getpid()} serving with {args.threads_per_worker} torch threads ({memory_report()})")
+    # Tell the parent this worker is warm; a worker it replaces is only retired now
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+    try:
+        server.serve_forever()
+    finally:
+        # Workers leave through os._exit, which skips atexit handlers
+        app_module.shutdown()
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not hasattr(os, 'fork'):
+        sys.exit("serve.py needs os.fork(); on this platform run app.py instead")
+
+    # Thread pools must be sized before torch initialises them in the parent
+    os.environ.setdefault('OMP_NUM_THREADS', str(args.threads_per_worker))
+    os.environ.setdefault('MKL_NUM_THREADS', str(args.threads_per_worker))
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
+    start = time.perf_counter()
+    import app as app_module
+    # One set of per-user risk aggregates for every worker, held by a process forked off here
+    app_module.share_risk_aggregates()
+    app_module.load_models(warm=False)  # vectorizer, scaler, forest and BERT are loaded once, before forking
+    print(f"Models loaded in parent {os.getpid()} in {time.perf_counter() - start:.1f}s ({memory_report()})")
+
+    # Move everything allocated so far out of the GC's reach so collections in the
+    # workers don't write to (and un-share) the pages holding the model objects
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+
+    workers = {}  # pid -> slot of the workers taking requests; a restarted worker takes over its predecessor's slot
+    warming = {}  # pid -> [slot, readiness pipe, pid of the worker it replaces] until the worker is warm
+    stopping = {}  # pid -> when a worker asked to stop gets killed instead
+    shutting_down = False
+    reload_requested = False
+    attempted_fingerprint = app_module.models.fingerprint
+
+    def spawn(slot, replaces=None):
+        ready_r, ready_w = os.pipe()
+        signal.pthread_sigmask(signal.SIG_BLOCK, PARENT_SIGNALS)
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(ready_r)
+                run_worker(sock, args, app_module, slot, ready_w)
+            except SystemExit:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, PARENT_SIGNALS)
+        os.close(ready_w)
+        warming[pid] = [slot, ready_r, replaces]
+
+    def stop(pid):
+        # SIGTERM lets the worker finish the requests it has; --graceful-timeout bounds the wait
+        if pid in stopping:
+            return
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        stopping[pid] = time.monotonic() + args.graceful_timeout
+
+    def close_pipe(pid):
+        if warming[pid][1] is not None:
+            os.close(warming[pid][1])
+            warming[pid][1] = None
+
+    def ready(pid):
+        close_pipe(pid)
+        slot, _, replaces = warming.pop(pid)
+        workers[pid] = slot
+        if workers.pop(replaces, None) is not None:
+            stop(replaces)
+
+    def exited(pid, status):
+        stopping.pop(pid, None)
+        if pid in warming:
+            close_pipe(pid)
+            slot, _, replaces = warming.pop(pid)
+            if replaces in workers:
+                print(f"Worker {pid} exited with status {status} before it was ready, keeping worker {replaces}")
+                return
+        else:
+            slot = workers.pop(pid, None)
+            if any(replaces == pid for _, _, replaces in warming.values()):
+                return  # its replacement is already warming up
+        if not shutting_down and slot is not None:
+            print(f"Worker {pid} exited with status {status}, restarting")
+            spawn(slot)
+
+    def reload():
+        # Load the new models here and fork a fresh set of workers that share them; each old worker
+        # keeps serving until its replacement has warmed up, then drains and exits
+        nonlocal attempted_fingerprint
+        attempted_fingerprint = app_module._artifact_fingerprint()
+        start = time.perf_counter()
+        try:
+            app_module.reload_models(warm=False)
+        except Exception:
+            return  # already logged; the current workers keep serving
+        print(f"Models reloaded in parent in {time.perf_counter() - start:.1f}s ({memory_report()}), "
+              f"replacing {len(workers)} workers")
+        # Let the collector reach the previous models' cycles, then freeze the new ones for sharing
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+        for pid, slot in sorted(workers.items(), key=lambda item: item[1]):
+            spawn(slot, replaces=pid)
+
+    # The handlers only record what to do; the main loop below does it, so every fork happens there
+    def shutdown(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+
+    def request_reload(signum, frame):
+        # SIGHUP, also sent by a worker's /admin/reload
+        nonlocal reload_requested
+        reload_requested = True
+
+    def check_artifacts(signum, frame):
+        # A broken artifact is only retried once it changes again
+        nonlocal reload_requested
+        if app_module._artifact_fingerprint() not in (app_module.models.fingerprint, attempted_fingerprint):
+            print("Model artifacts changed on disk, reloading...")
+            reload_requested = True
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGHUP, request_reload)
+    if app_module.MODEL_WATCH_INTERVAL > 0:
+        signal.signal(signal.SIGALRM, check_artifacts)
+        signal.setitimer(signal.ITIMER_REAL, app_module.MODEL_WATCH_INTERVAL, app_module.MODEL_WATCH_INTERVAL)
+
+    print(f"Listening on {args.host}:{args.port} with {args.workers} workers x {args.threads_per_worker} threads")
+    for slot in range(args.workers):
+        spawn(slot)
+
+    # Polled rather than blocking in os.wait(), so stopping workers can be killed once their time is up
+    while workers or warming or stopping or not shutting_down:
+        if shutting_down:
+            for pid in list(workers) + list(warming):
+                stop(pid)
+        elif reload_requested and not warming:
+            # Workers still warming up (from startup or the previous reload) are let finish first
+            reload_requested = False
+            reload()
+
+        pipes = {entry[1]: pid for pid, entry in warming.items() if entry[1] is not None}
+        readable, _, _ = select.select(list(pipes), [], [], 0.2)
+        for fd in readable:
+            if os.read(fd, 1):
+                ready(pipes[fd])
+            else:
+                close_pipe(pipes[fd])  # exited while warming up; reaped below
+
+        for pid in {*workers, *warming, *stopping}:
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done, status = pid, 0
+            if done:
+                exited(pid, status)
+
+        now = time.monotonic()
+        for pid, deadline in list(stopping.items()):
+            if now >= deadline:
+                print(f"Worker {pid} still busy after {args.graceful_timeout:.0f}s, killing it")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                stopping[pid] = float('inf')
+    sock.close()
+
+if __name__ == '__main__':
+    main()